@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+pytagomacs – An Emacs like key–value editor library for Python
+
+Copyright © 2013, 2014  Mattias Andrée (maandree@member.fsf.org)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os
+import sys
+import time
+
+from pytagomacs.common import *
+from pytagomacs.editor import *
+
+
+
+def typing_script():
+    '''
+    Typing on one line, with a correction now and then
+    
+    @return  :list<bytes>  The keystrokes
+    '''
+    return [b'\177' if i % 10 == 9 else bytes([ord('a') + i % 26]) for i in range(5000)]
+
+
+def paste_script():
+    '''
+    Pasting large texts with bracketed paste, arriving in terminal sized reads
+    
+    @return  :list<bytes>  The reads
+    '''
+    data = b'\033[200~' + (b'pasted text ' * 6000) + b'\033[201~'
+    keys = []
+    for _ in range(10):
+        keys += [data[i : i + 4096] for i in range(0, len(data), 4096)]
+        keys.append(ctrl('N').encode('utf-8'))
+    return keys
+
+
+def killring_script():
+    '''
+    Killing lines and yanking them back, cycling through the killring
+    
+    @return  :list<bytes>  The keystrokes
+    '''
+    keys = []
+    for _ in range(500):
+        keys += [ctrl(c).encode('utf-8') for c in 'AKYAKY']
+        keys += [b'\033y', b'\033y', ctrl('N').encode('utf-8')]
+    return keys
+
+
+def scrolling_script():
+    '''
+    Paging through all lines and back, and moving line by line
+    
+    @return  :list<bytes>  The keystrokes
+    '''
+    keys = [b'\033[6~'] * 500 + [b'\033[5~'] * 500
+    keys += [ctrl('N').encode('utf-8')] * 2000 + [ctrl('P').encode('utf-8')] * 2000
+    return keys
+
+
+def holding_script():
+    '''
+    Holding down the key for the next line, so that the keys arrive faster than they are shown
+    
+    @return  :list<bytes>  The reads
+    '''
+    return [ctrl('N').encode('utf-8') * 300] * 3 + [ctrl('P').encode('utf-8') * 300] * 3
+
+
+def search_script():
+    '''
+    Searching for fields by typing their names one character at a
+    time, and moving to the next and the previous occurrence
+    
+    @return  :list<bytes>  The keystrokes
+    '''
+    keys = []
+    for i in range(20):
+        keys.append(ctrl('S').encode('utf-8'))
+        keys += [bytes([c]) for c in ('field %05i' % (i * 4999)).encode('utf-8')]
+        keys += [ctrl('S').encode('utf-8'), ctrl('R').encode('utf-8'), b'\n']
+    return keys
+
+
+SCRIPTS = [('typing', 10, typing_script, {}), ('paste', 10, paste_script, {}),
+           ('kill/yank', 1000, killring_script, {}), ('scrolling', 10000, scrolling_script, {}),
+           ('scroll/full', 10000, scrolling_script, {'full_width' : True}),
+           ('holding', 1000, holding_script, {'coalesce' : True}),
+           ('hold/full', 1000, holding_script, {'coalesce' : True, 'full_width' : True}),
+           ('search', 100000, search_script, {})]
+'''
+:list<(str, int, ()→list<bytes>, dict<str, bool>)>  The benchmarks: their names, the number of fields to edit,
+                                                    their scripts, and the options to pass to `replay`
+'''
+
+
+
+IMPORT_BUDGET = 15
+'''
+:float  The number of milliseconds importing `pytagomacs.editor` may take
+'''
+
+
+
+def import_time(runs = 5):
+    '''
+    Measure how long it takes to import `pytagomacs.editor` in a new Python process
+    
+    @param   runs:int  The number of times to measure, the best time is used
+    @return  :float    The number of milliseconds spent importing the module, including what it imports
+    '''
+    import subprocess
+    env = dict(os.environ, PYTHONPATH = os.pathsep.join(p for p in sys.path if p != ''))
+    # Let the first run write the bytecode, so that compiling is not measured
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    command = [sys.executable, '-X', 'importtime', '-c', 'import pytagomacs.editor']
+    best = None
+    for _ in range(runs):
+        report = subprocess.run(command, env = env, stderr = subprocess.PIPE).stderr.decode('utf-8', 'replace')
+        for line in report.split('\n'):
+            # import time: self [us] | cumulative | imported package
+            fields = line.split('|')
+            if (len(fields) == 3) and (fields[2].strip() == 'pytagomacs.editor'):
+                elapsed = int(fields[1]) / 1000
+                best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def replay(keys, count, width = 80, height = 24, coalesce = False, full_width = False):
+    '''
+    Replay keystrokes in a text area that is not connected to a terminal, unless `coalesce`
+    is used the screen is updated after every keystroke, so that the output does not depend
+    on how fast the keystrokes are handled
+    
+    @param   keys:list<bytes>  The keystrokes, as they are read from the terminal, one read is counted as one keystroke
+    @param   count:int         The number of fields in the text area
+    @param   width:int         The width of the text area
+    @param   height:int        The height of the text area
+    @param   coalesce:bool     Whether to skip updating the screen for keys that are followed by more keys in the same read
+    @param   full_width:bool   Whether the text area is to be treated as spanning the whole width of the terminal,
+                               so that it is scrolled with scroll regions if `SCROLL_REGIONS` is set
+    @return  :(float, float)   The number of keystrokes per second, and the number of bytes written per keystroke
+    '''
+    fields = ['field %05i' % i for i in range(count)]
+    datamap = dict((name, 'value of ' + name) for name in fields)
+    exit = ctrl('X').encode('utf-8') + ctrl('C').encode('utf-8')
+    with open(os.devnull, 'wb') as sink:
+        area = TextArea(fields, datamap, 1, 1, width, height, source = keys + [exit], sink = sink)
+        area.coalesce = coalesce
+        area.scroll_regions = SCROLL_REGIONS and full_width
+        area.initialise(False)
+        written = area.output.written
+        start = time.monotonic()
+        area.run(lambda : True)
+        elapsed = time.monotonic() - start
+        written = area.output.written - written
+        area.close()
+    return (len(keys) / elapsed, written / len(keys))
+
+
+if __name__ == '__main__': # Run all benchmarks, and fail if importing takes too long
+    for name, count, script, options in SCRIPTS:
+        keys = script()
+        (speed, size) = replay(keys, count, **options)
+        print('%-12s %6i keys  %10.0f keys/s  %8.1f bytes/key' % (name, len(keys), speed, size))
+    elapsed = import_time()
+    print('%-12s %8.1f ms (budget %.1f ms)' % ('import', elapsed, IMPORT_BUDGET))
+    if elapsed > IMPORT_BUDGET:
+        sys.exit(1)
@@ -19,6 +19,7 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 import os
+import sys
 
 
 
@@ -52,11 +53,81 @@ KILLRING_LIMIT = 50
 :int  The maximum size of the killring
 '''
 
+KILLRING_BUDGET = None
+'''
+:int?  The maximum number of bytes the texts in the killring may use in memory, `None` for no limit
+'''
+
+KILLRING_SPILL = None
+'''
+:int?  Killed texts of at least this many bytes are stored in temporary files
+       rather than in memory, `None` to keep all texts in memory
+'''
+
 EDITRING_LIMIT = 100
 '''
 :int  The maximum size of the editring
 '''
 
+EDITRING_IDLE = 1
+'''
+:float  The number of seconds the user must idle before the next edit is stored
+        separately from the previous edit in the editring, rather than merged with it
+'''
+
+JOURNAL_DIRECTORY = None
+'''
+:str?  The directory where the edit histories of documents are stored,
+       `None` for `$XDG_CACHE_HOME/pytagomacs` or `~/.cache/pytagomacs`
+'''
+
+LINE_BUFFER = None
+'''
+:(str)→buffer?  The class lines store their text in, `None` for `GapBuffer`,
+                it must support `len`, `str`, indexing, slicing and `replace(start, end, text)`
+'''
+
+BUFFERED_OUTPUT = True
+'''
+:bool  Whether to write all output for a keystroke at once, set to `False`
+       to print output as soon as it is produced, which eases debugging
+'''
+
+SCROLL_REGIONS = True
+'''
+:bool  Whether to scroll the text area with scroll regions when it spans the whole width of the
+       terminal, so that only the lines that scroll into view are sent, `False` for terminals
+       that do not support scroll regions, the `scroll_regions` attribute of a text area tells
+       whether it uses them
+'''
+
+MAX_FRAME_RATE = 60
+'''
+:float?  The maximum number of times per second the screen is updated, if keys arrive faster
+         only the latest state is shown, `None` to update the screen after every key that
+         is not immediately followed by another key
+'''
+
+MIN_FRAME_RATE = 4
+'''
+:float  The number of times per second the screen is updated while
+        keys arrive faster than they can be handled
+'''
+
+COALESCE_FRAMES = True
+'''
+:bool  Whether to skip updating the screen for keys that are immediately followed by more keys,
+       as limited by `MAX_FRAME_RATE` and `MIN_FRAME_RATE`, `False` to update the screen after
+       every key, it can also be changed by setting the `coalesce` attribute of a text area
+'''
+
+INSTRUMENTATION_FILE = None
+'''
+:str?  File to which statistics about how long keys take to handle, and how much is written for them,
+       are written when a text area is closed, `None` to not collect statistics, they can also be
+       collected by setting the `instrumentation` attribute of a text area to an `Instrumentation`
+'''
+
 
 atleast = lambda x, minimum : (x is not None) and (x >= minimum)
 '''
@@ -73,84 +144,200 @@ ctrl = lambda key : chr(ord(key) ^ ord('@'))
 Return the symbol for a specific letter pressed in combination with Ctrl
 '''
 
-backspace = lambda x : (ord(x) == 127) or (ord(x) == 8)
+backspace = lambda x : (x == '\177') or (x == '\b')
 '''
 Check if a key stroke is a backspace key stroke
 '''
 
 
+KEYMAP = {
+    -1 : 'page-up',  -2 : 'page-down',  -3 : 'backward-word',  -4 : 'forward-word',  -5 : 'override-mode',
+    -6 : 'select-backward',  -7 : 'select-forward',  -8 : 'copy',  -9 : 'yank-cycle',
+    ctrl('P') : 'previous-line',  ctrl('N') : 'next-line',  '\n' : 'next-line',
+    ctrl('F') : 'forward-char',  ctrl('B') : 'backward-char',
+    ctrl('E') : 'end-of-line',  ctrl('A') : 'beginning-of-line',
+    ctrl('@') : 'set-mark',  ctrl('D') : 'delete',  '\177' : 'erase',  '\b' : 'erase',
+    ctrl('K') : 'kill',  ctrl('W') : 'cut',  ctrl('Y') : 'yank',
+    ctrl('_') : 'undo',  ctrl('U') : 'undo',  ctrl('G') : 'change-direction',  ctrl('L') : 'redraw',
+    ctrl('S') : 'isearch-forward',  ctrl('R') : 'isearch-backward',
+    (ctrl('X'), ctrl('X')) : 'swap-mark',  (ctrl('X'), ctrl('S')) : 'save',  (ctrl('X'), ctrl('C')) : 'exit',
+}
+'''
+:dict<str|int|(str, str|int), str|(TextArea)→void|None>  The key bindings of text areas, keys that follow a prefix key are
+                                                        paired with it, a key is bound to the name of a command, to a
+                                                        function that is called with the text area, or to `None` to
+                                                        unbind it, printable text that is not bound is inserted, the
+                                                        configuration script can change the bindings, for example
+                                                        `KEYMAP[ctrl('J')] = 'next-line'`, names of commands that do
+                                                        not exist are reported when the text area is started
+'''
+
+
 
 class Jump():
     '''
     Create a cursor jump that can either be included in a print statement
     as a string or invoked
     
-    @param   y:int         The row, 1 based
-    @param   x:int         The column, 1 based
-    @string  :str|()→void  Functor that can be treated as a string for jumping
+    @param   y:int           The row, 1 based
+    @param   x:int           The column, 1 based
+    @param   output:Output?  The output buffer to write to when invoked, `None` for stdout
+    @string  :str|()→void    Functor that can be treated as a string for jumping
     '''
-    def __init__(self, y, x):
+    def __init__(self, y, x, output = None):
         self.string = '\033[%i;%iH' % (y, x)
+        self.output = output
     def __str__(self):
         return self.string
     def __call__(self):
-        print(self.string, end = '')
+        if self.output is not None:
+            self.output.write(self.string)
+        else:
+            print(self.string, end = '')
+
+
+def cache_directory():
+    '''
+    Get the directory where pytagomacs stores cached data
+    
+    @return  :str  `$XDG_CACHE_HOME/pytagomacs`, or `~/.cache/pytagomacs` if `$XDG_CACHE_HOME` is not set
+    '''
+    if os.environ.get('XDG_CACHE_HOME', '') != '':
+        directory = os.environ['XDG_CACHE_HOME']
+    else:
+        directory = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(directory, 'pytagomacs')
+
 
 
 ## Load extension and configurations via pytagomacsrc.
 config_file = None
-# Possible auto-selected configuration scripts,
-# earlier ones have precedence, we can only select one.
-files = []
-def add_files(var, *ps, multi = False):
-    if var == '~':
-        try:
-            # Get the home (also known as initial) directory of the real user
-            import pwd
-            var = pwd.getpwuid(os.getuid()).pw_dir
-        except:
-            return
-    else:
-        # Resolve environment variable or use empty string if none is selected
-        if (var is None) or (var in os.environ) and (not os.environ[var] == ''):
-            var = '' if var is None else os.environ[var]
+'''
+:str?  The configuration script that has been loaded, `None` if there is none
+'''
+
+config_loaded = False
+'''
+:bool  Whether `load_config` has been invoked
+'''
+
+def config_files():
+    '''
+    Get the pathnames of the possible auto-selected configuration scripts
+    
+    @return  :list<str>  The pathnames, earlier ones have precedence, we can only select one
+    '''
+    files = []
+    def add_files(var, *ps, multi = False):
+        if var == '~':
+            try:
+                # Get the home (also known as initial) directory of the real user
+                import pwd
+                var = pwd.getpwuid(os.getuid()).pw_dir
+            except:
+                return
         else:
-            return
-    paths = [var]
-    # Split environment variable value if it is a multi valeu variable
-    if multi and os.pathsep in var:
-        paths = [v for v in var.split(os.pathsep) if not v == '']
-    # Add files according to patterns
-    for p in ps:
-        p = p.replace('/', os.sep).replace('%', 'pytagomacs')
-        for v in paths:
-            files.append(v + p)
-add_files('XDG_CONFIG_HOME', '/%/%rc', '/%rc')
-add_files('HOME',            '/.config/%/%rc', '/.config/%rc', '/.%rc')
-add_files('~',               '/.config/%/%rc', '/.config/%rc', '/.%rc')
-add_files('XDG_CONFIG_DIRS', '/%rc', multi = True)
-add_files(None,              '/etc/%rc')
-for file in files:
-    # If the file we exists,
-    if os.path.exists(file):
-        # select it,
-        config_file = file
-        # and stop trying files with lower precedence.
-        break
-if config_file is not None:
+            # Resolve environment variable or use empty string if none is selected
+            if (var is None) or (var in os.environ) and (not os.environ[var] == ''):
+                var = '' if var is None else os.environ[var]
+            else:
+                return
+        paths = [var]
+        # Split environment variable value if it is a multi valeu variable
+        if multi and os.pathsep in var:
+            paths = [v for v in var.split(os.pathsep) if not v == '']
+        # Add files according to patterns
+        for p in ps:
+            p = p.replace('/', os.sep).replace('%', 'pytagomacs')
+            for v in paths:
+                files.append(v + p)
+    add_files('XDG_CONFIG_HOME', '/%/%rc', '/%rc')
+    add_files('HOME',            '/.config/%/%rc', '/.config/%rc', '/.%rc')
+    add_files('~',               '/.config/%/%rc', '/.config/%rc', '/.%rc')
+    add_files('XDG_CONFIG_DIRS', '/%rc', multi = True)
+    add_files(None,              '/etc/%rc')
+    return files
+
+
+def compile_config(file):
+    '''
+    Compile a configuration script, the compiled script is cached, in the
+    same way Python caches modules, so that it is only compiled again when
+    the script's modification time or size changes
+    
+    @param   file:str  The pathname of the configuration script
+    @return  :code     The compiled script
+    '''
+    import marshal
+    from importlib.util import MAGIC_NUMBER
+    from urllib.parse import quote
+    stat = os.stat(file)
+    header = MAGIC_NUMBER + (' %i %i\n' % (stat.st_mtime_ns, stat.st_size)).encode('utf-8')
+    cache = quote(os.path.abspath(file), safe = '') + '.' + str(sys.implementation.cache_tag) + '.pyc'
+    cache = os.path.join(cache_directory(), 'rc', cache)
+    try:
+        with open(cache, 'rb') as cached:
+            data = cached.read()
+        if data.startswith(header):
+            return marshal.loads(data[len(header):])
+    except (OSError, ValueError, EOFError, TypeError):
+        pass
     code = None
     # Read configuration script file
-    with open(config_file, 'rb') as script:
+    with open(file, 'rb') as script:
         code = script.read()
     # Decode configurion script file and add a line break
     # at the end to ensure that the last line is empty.
     # If it is not, we will get errors.
     code = code.decode('utf-8', 'error') + '\n'
-    # Compile the configuration script,
-    code = compile(code, config_file, 'exec')
-    # and run it, with it have the same
-    # globals as this module, so that it can
+    # Compile the configuration script
+    code = compile(code, file, 'exec')
+    try:
+        os.makedirs(os.path.dirname(cache), exist_ok = True)
+        with open(cache + '.tmp', 'wb') as cached:
+            cached.write(header + marshal.dumps(code))
+        os.replace(cache + '.tmp', cache)
+    except OSError:
+        pass
+    return code
+
+
+def load_config():
+    '''
+    Find and run the configuration script, unless already done, this is
+    done when the first text area is created, and can be done earlier to
+    use the configurations before that
+    
+    @return  :str?  The pathname of the configuration script, `None` if there is none
+    '''
+    global config_file, config_loaded
+    if config_loaded:
+        return config_file
+    config_loaded = True
+    for file in config_files():
+        # If the file we exists,
+        if os.path.exists(file):
+            # select it,
+            config_file = file
+            # and stop trying files with lower precedence.
+            break
+    if config_file is None:
+        return None
+    code = compile_config(config_file)
+    # Run the configuration script, with it have the
+    # same globals as this module, so that it can
     # not only use want we have defined, but
     # also redefine it for us.
-    exec(code, globals())
-
+    definitions = globals()
+    before = dict(definitions)
+    exec(code, definitions)
+    # The other modules have already imported our definitions,
+    # give them the definitions the script has redefined
+    redefined = [name for name in before if definitions.get(name, before[name]) is not before[name]]
+    for module in list(sys.modules.values()):
+        if (module is sys.modules[__name__]) or not getattr(module, '__name__', '').startswith('pytagomacs.'):
+            continue
+        for name in redefined:
+            if getattr(module, name, None) is before[name]:
+                setattr(module, name, definitions[name])
+    return config_file
@@ -19,61 +19,43 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 import sys
-import string
-from subprocess import Popen, PIPE
-
-import gettext
-gettext.bindtextdomain('@PKGNAME@', '@LOCALEDIR@')
-gettext.textdomain('@PKGNAME@')
-_ = gettext.gettext
+import time
+from collections import deque
 
 from pytagomacs.killring import *
 from pytagomacs.editring import *
+from pytagomacs.instrument import *
 from pytagomacs.common import *
+from pytagomacs.output import *
+from pytagomacs.screen import *
+from pytagomacs.reader import *
+from pytagomacs.terminal import *
 from pytagomacs.line import *
 
 
 
-## TODO  widthless characters should be ignored when calculating the size a text
-## TODO  implement undo history
-## 
-##    Until the user has halted for 1 second (configurably) or has navigated using arrow keys or alternative key combinations,
-##    edits should be accumulated and then stored in the editring. The edits is stored when the next keystroke is made, there
-##    should not be a timer waits for the user to idle.
-## 
-
-_copy, _cut, _kill, _delete, _erase = Line.copy, Line.cut, Line.kill, Line.delete, Line.erase
-_yank, _yank_cycle, _move_point = Line.yank, Line.yank_cycle, Line.move_point
-_swap_mark, _override = Line.swap_mark, Line.override
-
-## Editing methods to wrap for undo history
-def full_edit(self, func):
-    # TODO commit changes, if any
-    rc = func(self)
-    # TODO commit changes, if any
-    # TODO reset
-    return rc
-
-def partial_edit(self, func):
-    # TODO commit changes, if any, if one second has elapsed, and then reset
-    return func(self)
-
-break_edit = lambda self, func : full_edit(self, func)
+def _(text):
+    '''
+    Translate a message, the translations are not looked up until the first message is translated
+    
+    @param   text:str  The message
+    @return  :str      The translated message
+    '''
+    global _
+    import gettext
+    gettext.bindtextdomain('@PKGNAME@', '@LOCALEDIR@')
+    gettext.textdomain('@PKGNAME@')
+    _ = gettext.gettext
+    return _(text)
 
-Line.copy       = lambda self :   break_edit(self, _copy)
-Line.cut        = lambda self :    full_edit(self, _cut)
-Line.kill       = lambda self :    full_edit(self, _kill)
-Line.yank       = lambda self : partial_edit(self, _yank)
-Line.yank_cycle = lambda self : partial_edit(self, _yank_cycle)
-Line.swap_mark  = lambda self :   break_edit(self, _swap_mark)
 
-def __move_point(self, delta):
-    return break_edit(self, lambda s : _move_point(s, delta))
-Line.move_point = __move_point
 
-def __override(self, insert, override = True):
-    partial_edit(self, lambda s : _override(s, insert, override));
-Line.override = __override
+## TODO  widthless characters should be ignored when calculating the size a text
+## 
+##    Undo history: until the user has halted for 1 second (configurably) or has navigated using arrow keys or alternative
+##    key combinations, edits are accumulated and then stored in the editring. The edits is stored when the next keystroke
+##    is made, there is no timer that waits for the user to idle.
+## 
 
 
 class TextArea():
@@ -81,7 +63,7 @@ class TextArea():
     GNU Emacs alike text area
     '''
     
-    def __init__(self, fields, datamap, left = 1, top = 1, width = None, height = None):
+    def __init__(self, fields, datamap, left = 1, top = 1, width = None, height = None, document = None, source = None, sink = None):
         '''
         Constructor
         
@@ -91,21 +73,71 @@ class TextArea():
         @param  top:int                 Top  position of the component, 1 based
         @param  width:int?              Width of the component,  `None` for screen width − left offset, negative for `None` plus that value
         @param  height:int?             Height of the component, `None` for screen height − top offset, negative for `None` plus that value
+        @param  document:str?           ID of the document, used to keep the edit history between sessions, `None` to not keep it
+        @param  source:itr<bytes>?      Input to read instead of the terminal, `None` for stdin, if used the
+                                        width and height should be positive so that the terminal is not used
+        @param  sink:¿W?                Binary file-like object to write to instead of the terminal, `None` for stdout
         '''
-        if width  is None: width  = 0
-        if height is None: height = 0
-        if (width <= 0) or (height <= 0):
-            screen_size = Popen('stty size'.split(' '), stdout = PIPE).communicate()[0].decode('utf-8', 'error')[:-1].split(' ')
-            if width <= 0:   width  += int(screen_size[1]) - left + 1
-            if height <= 0:  height += int(screen_size[0]) - top  + 1
-        self.fields, self.datamap, self.left, self.top, self.width, self.height = fields, datamap, left, top, width - 1, height
+        load_config()
+        self.fields, self.datamap, self.left, self.top = fields, datamap, left, top
+        self.requested_size = (width, height)
+        (self.width, self.height) = self.measure()
         self.innerleft = len(max(self.fields, key = len)) + 3
-        self.killring, self.editring = Killring(limit = KILLRING_LIMIT), Editring(limit = EDITRING_LIMIT)
-        data = lambda field : datamap[field] if field in datamap else ''
-        self.lines = [Line(self, self.fields[y], data(self.fields[y]), y) for y in range(len(self.fields))]
+        journal = None
+        if document is not None:
+            from pytagomacs.journal import Journal, journal_path
+            journal = Journal(journal_path(document), fields)
+        self.killring = Killring(limit = KILLRING_LIMIT, budget = KILLRING_BUDGET, spill = KILLRING_SPILL)
+        self.editring = Editring(limit = EDITRING_LIMIT, journal = journal)
+        self.output = Output(buffered = BUFFERED_OUTPUT, sink = sink)
+        self.screen = Screen(self.output, self.top, self.left, self.height, self.width + 1)
+        self.reader = Reader(source = source)
+        self.lines = Lines(self)
         self.areawidth = self.width - self.innerleft
         self.y, self.offy, self.x, self.offx, self.mark = 0, 0, 0, 0, None
         self.last_alert, self.last_status, self.alerted = None, None, False
+        self.pending_edit, self.edit_depth, self.edit_x, self.edit_time = None, 0, 0, 0
+        self.dirty, self.saving, self.posted = {}, None, deque()
+        self.instrumentation = None if INSTRUMENTATION_FILE is None else Instrumentation(INSTRUMENTATION_FILE)
+        self.keymap = dict(KEYMAP)
+        self.coalesce = COALESCE_FRAMES
+        self.scroll_regions = SCROLL_REGIONS and (left == 1) and (width in (None, 0))
+        self.search_index = None
+    
+    
+    def measure(self):
+        '''
+        Calculate the size of the component from the size requested in the constructor
+        
+        @return  (width, height):(int, int)  The width, excluding the last column, and the height of the component
+        '''
+        (width, height) = self.requested_size
+        if width  is None: width  = 0
+        if height is None: height = 0
+        if (width <= 0) or (height <= 0):
+            screen_size = get_size()
+            if width <= 0:   width  += screen_size[1] - self.left + 1
+            if height <= 0:  height += screen_size[0] - self.top  + 1
+        return (width - 1, height)
+    
+    
+    def resize(self):
+        '''
+        Update the geometry of the component after the terminal has been resized
+        
+        @return  :bool  Whether the size of the component changed
+        '''
+        (width, height) = self.measure()
+        if (width, height) == (self.width, self.height):
+            return False
+        self.width, self.height = width, height
+        self.areawidth = self.width - self.innerleft
+        self.screen.resize(self.height, self.width + 1)
+        if self.y - self.offy > self.height - 3:
+            self.offy = max(self.y - self.height + 3, 0)
+        if self.x - self.offx > self.areawidth:
+            self.offx = max(self.x - self.areawidth // 4, 0)
+        return True
     
     
     
@@ -117,22 +149,146 @@ class TextArea():
         '''
         self.initalise_terminal = initalise_terminal
         if initalise_terminal:
-            print('\033[?1049h', end='', flush=True)
-        print('\033[H\033[2J', end='', flush=True)
-        self.old_stty = Popen('stty --save'.split(' '), stdout = PIPE).communicate()[0]
-        self.old_stty = self.old_stty.decode('utf-8', 'error')[:-1]
-        Popen('stty -icanon -echo -isig -ixon -ixoff'.split(' '), stdout = PIPE).communicate()
+            self.output.write('\033[?1049h')
+        self.output.write('\033[H\033[2J\033[?2004h')
+        self.output.flush()
+        self.reader.start()
+        (self.old_mode, self.old_sigwinch) = (None, None)
+        if self.reader.source is not None:
+            # Not reading from a terminal
+            return
+        self.old_mode = save_mode(self.reader.fd)
+        set_mode(self.reader.fd)
+        import signal
+        try:
+            self.old_sigwinch = signal.signal(signal.SIGWINCH, lambda signo, frame : self.reader.interrupt(-10))
+        except ValueError:
+            # Signal handlers can only be installed from the main thread
+            self.old_sigwinch = None
     
     
     def close(self):
         '''
-        Restore the terminal to the state before `initialise` as invoked
+        Restore the terminal to the state before `initialise` as invoked,
+        after waiting for a save in the background to finish
         '''
-        sys.stdout.flush()
-        Popen(['stty', self.old_stty], stdout = PIPE).communicate()
-        print('\033[H\033[2J', end='', flush=True)
+        if self.saving is not None:
+            self.saving[0]()
+        self.output.flush()
+        if self.instrumentation is not None:
+            # The keys that have not been shown yet, such as the key that closed the text area
+            self.instrumentation.end(self.output)
+        if self.old_mode is not None:
+            restore_mode(self.reader.fd, self.old_mode)
+        if self.old_sigwinch is not None:
+            import signal
+            signal.signal(signal.SIGWINCH, self.old_sigwinch)
+        self.reader.stop()
+        self.output.write('\033[?2004l\033[H\033[2J')
         if self.initalise_terminal:
-            print('\033[?1049l', end='', flush=True)
+            self.output.write('\033[?1049l')
+        self.output.flush()
+        if (self.instrumentation is not None) and (self.instrumentation.path is not None):
+            self.instrumentation.dump()
+    
+    
+    
+    def begin_edit(self, full):
+        '''
+        Prepare for an operation that may edit the text
+        
+        @param  full:bool  Whether the operation should be stored as a separate edit,
+                           rather than possibly merged with the previous edit
+        '''
+        if self.edit_depth == 0:
+            if full or (time.monotonic() - self.edit_time >= EDITRING_IDLE):
+                self.commit_edit()
+            self.edit_x = self.x
+        self.edit_depth += 1
+    
+    
+    def end_edit(self, full):
+        '''
+        Finish an operation started with `begin_edit`
+        
+        @param  full:bool  Whether the operation should be stored as a separate edit,
+                           rather than possibly merged with the next edit
+        '''
+        self.edit_depth -= 1
+        if self.edit_depth == 0:
+            if self.pending_edit is not None:
+                self.pending_edit.new_x = self.x
+                self.edit_time = time.monotonic()
+            if full:
+                self.commit_edit()
+    
+    
+    def record_edit(self, line, start, end, text):
+        '''
+        Record a change to a line, before it is made, the change is merged with the
+        edit that has not been stored in the editring yet if the change touches the
+        text that edit inserted, otherwise that edit is stored first
+        
+        @param  line:Line  The line
+        @param  start:int  The index of the first character to replace
+        @param  end:int    The index of the character after the last character to replace
+        @param  text:str   The text to insert in place of the replaced text
+        '''
+        edit, buffer = self.pending_edit, line.buffer
+        if (edit is not None) and (edit.y == line.y) and (edit.x <= end) and (start <= edit.x + len(edit.inserted)):
+            # The text between x and i is the text the edit inserted, so only
+            # the parts of the change outside it need to be read from the line
+            x, i = edit.x, edit.x + len(edit.inserted)
+            if start < x:
+                edit.deleted = buffer[start : x] + edit.deleted
+            if end > i:
+                edit.deleted += buffer[i : end]
+            edit.inserted = edit.inserted[: max(start - x, 0)] + text + edit.inserted[max(end - x, 0) :]
+            edit.x = min(x, start)
+        else:
+            self.commit_edit()
+            self.pending_edit = Edit(buffer[start : end], text, line.y, self.edit_x, self.edit_x, start)
+    
+    
+    def commit_edit(self):
+        '''
+        Store the edit that has not been stored in the editring yet, if any
+        '''
+        if self.pending_edit is not None:
+            self.editring.push(self.pending_edit)
+            self.pending_edit = None
+    
+    
+    
+    def touch(self, line):
+        '''
+        Record that a line is about to be changed, so that it is included in the next save
+        
+        @param  line:Line  The line
+        '''
+        if line.y not in self.dirty:
+            self.dirty[line.y] = self.datamap.get(line.name, None)
+        if self.search_index is not None:
+            self.search_index.invalidate(line.y)
+    
+    
+    def dirty_fields(self):
+        '''
+        Get the fields that have been modified since the last save, this
+        can be used by the saver to only write what has changed
+        
+        @return  :dict<str, str?>  Modified fields mapped to their values at the last save,
+                                   `None` for fields that were not in the data map, while a
+                                   save is running in the background, the fields it saves
+        '''
+        if self.saving is not None:
+            # A save is running in the background, the lines may be edited meanwhile
+            return dict(self.saving[1])
+        rc = {}
+        for y, value in self.dirty.items():
+            if self.lines[y].text != ('' if value is None else value):
+                rc[self.fields[y]] = value
+        return rc
     
     
     
@@ -170,14 +326,8 @@ class TextArea():
         @param  text:str  The message
         '''
         txt = ' (' + text + ') '
-        y = self.top + self.y - self.offy
-        x = self.left + self.innerleft + self.x - self.offx
         dashes = max(self.width - len(txt), 0)
-        Jump(self.top + self.height - 2, self.left)()
-        if STATUS_COLOUR is not None:
-            print('\033[%sm%s-\033[00m%s' % (STATUS_COLOUR, self.limit_text(txt + '-' * dashes), Jump(y, x)), end='')
-        else:
-            print('%s-%s' % (self.limit_text(txt + '-' * dashes), Jump(y, x)), end='')
+        self.screen.put(self.height - 2, 0, self.limit_text(txt + '-' * dashes) + '-', STATUS_COLOUR)
         self.last_status = text
     
     def alert(self, text):
@@ -190,13 +340,9 @@ class TextArea():
             self.alert('')
             self.alerted = False
         else:
-            y = self.top + self.y - self.offy
-            x = self.left + self.innerleft + self.x - self.offx
-            Jump(self.top + self.height - 1, self.left)()
-            if ALERT_COLOUR is not None:
-                print('\033[2K\033[%sm%s\033[00m%s' % (ALERT_COLOUR, self.limit_text(text), Jump(y, x)), end='')
-            else:
-                print('\033[2K%s%s' % (self.limit_text(text), Jump(y, x)), end='')
+            text = self.limit_text(text)
+            self.screen.put(self.height - 1, 0, text, ALERT_COLOUR)
+            self.screen.put(self.height - 1, len(text), ' ' * (self.width + 1 - len(text)))
             self.alerted = True
         self.last_alert = text
     
@@ -212,42 +358,210 @@ class TextArea():
         '''
         self.alert(self.last_alert)
     
+    def flush(self):
+        '''
+        Send everything that has been drawn to the terminal
+        '''
+        self.screen.move(self.y - self.offy, self.innerleft + limit(0, self.x - self.offx, self.areawidth))
+        self.screen.render()
+        self.output.flush()
+    
     
-    def run(self, saver, preredrawer = None, postredrawer = None):
+    def post(self, function):
+        '''
+        Call a function between two keystrokes and repaint the text area
+        afterwards, this can be used by other threads or tasks to update
+        the text area while `run` or `run_async` is running
+        
+        @param  function:()→(void|awaitable)  The function, it may return an awaitable if `run_async` is used
+        '''
+        self.posted.append(function)
+        self.reader.interrupt(-12)
+    
+    
+    def run(self, saver, preredrawer = None, postredrawer = None, background = False):
         '''
         Execute text reading
         
-        @param  saver:()→bool          Save method
+        @param  saver:()→bool          Save method, the modified fields have been written to
+                                       the data map, and are returned by `dirty_fields`
         @param  preredrawer:()?→void   Method to call before redrawing screen
         @param  postredrawer:()?→void  Method to call after  redrawing screen
+        @param  background:bool        Whether to call the saver in a separate thread, so that the user can
+                                       continue editing, the data map is not modified while it is running
+        '''
+        import threading
+        
+        def spawn(function, callback):
+            def run():
+                try:
+                    rc = function()
+                except Exception:
+                    rc = False
+                callback(rc)
+            thread = threading.Thread(target = run)
+            thread.start()
+            return thread.join
+        
+        session = self.interact(saver, preredrawer, postredrawer, background, spawn)
+        try:
+            request = next(session)
+            while True:
+                if request is None:
+                    request = session.send(self.reader.get())
+                elif isinstance(request, float):
+                    request = session.send(self.reader.has_input(request))
+                else:
+                    request = session.send(request())
+        except StopIteration:
+            pass
+    
+    
+    async def run_async(self, saver, preredrawer = None, postredrawer = None, background = False):
+        '''
+        Execute text reading in an asyncio event loop, other tasks keep running
+        while the user is editing, and may update the text area using `post`
+        
+        @param  saver:()→(bool|awaitable<bool>)          Save method, the modified fields have been written to
+                                                         the data map, and are returned by `dirty_fields`
+        @param  preredrawer:()?→(void|awaitable<void>)   Method to call before redrawing screen
+        @param  postredrawer:()?→(void|awaitable<void>)  Method to call after  redrawing screen
+        @param  background:bool                          Whether to save in a separate task, so that the user can
+                                                         continue editing, the data map is not modified while it is running,
+                                                         a saver that is not a coroutine function is called in a thread
+        '''
+        import asyncio
+        import inspect
+        loop, ready, failure, tasks = asyncio.get_running_loop(), asyncio.Event(), [], []
+        
+        def readable():
+            try:
+                self.reader.read()
+            except (EOFError, OSError) as err:
+                loop.remove_reader(self.reader.fd)
+                failure.append(err)
+            ready.set()
+        
+        def interrupted():
+            self.reader.drain()
+            ready.set()
+        
+        def spawn(function, callback):
+            async def run():
+                try:
+                    if inspect.iscoroutinefunction(function):
+                        rc = await function()
+                    else:
+                        rc = await loop.run_in_executor(None, function)
+                except Exception:
+                    rc = False
+                callback(rc)
+            task = loop.create_task(run())
+            tasks.append(task)
+            return lambda : task
+        
+        async def has_input(timeout):
+            if self.reader.has_input(0):
+                return True
+            if timeout <= 0:
+                return False
+            ready.clear()
+            try:
+                await asyncio.wait_for(ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            return self.reader.has_input(0)
+        
+        async def get():
+            while True:
+                key = self.reader.next()
+                if key is not None:
+                    return key
+                if self.reader.source is not None:
+                    # Let other tasks run between keys, as when reading from a terminal
+                    await asyncio.sleep(0)
+                    self.reader.read()
+                    continue
+                if len(failure) > 0:
+                    raise failure[0]
+                ready.clear()
+                await ready.wait()
+        
+        if self.reader.source is None:
+            loop.add_reader(self.reader.fd, readable)
+        if self.reader.pipe is not None:
+            loop.add_reader(self.reader.pipe[0], interrupted)
+        session = self.interact(saver, preredrawer, postredrawer, background, spawn)
+        try:
+            request = next(session)
+            while True:
+                if request is None:
+                    reply = await get()
+                elif isinstance(request, float):
+                    reply = await has_input(request)
+                else:
+                    reply = request()
+                    if inspect.isawaitable(reply):
+                        reply = await reply
+                request = session.send(reply)
+        except StopIteration:
+            pass
+        finally:
+            if self.reader.source is None:
+                loop.remove_reader(self.reader.fd)
+            if self.reader.pipe is not None:
+                loop.remove_reader(self.reader.pipe[0])
+            # Let a save that is running finish before the text area is closed
+            await asyncio.gather(*tasks, return_exceptions = True)
+    
+    
+    def interact(self, saver, preredrawer, postredrawer, background, spawn):
+        '''
+        Generator that implements `run` and `run_async`, it yields `None` when it needs the next
+        key, which shall be sent to it, a number of seconds when it needs to know whether there
+        will be input within that time, which shall be sent to it, and functions it needs to be
+        called, whose return values shall be sent to it, it stops when the user exits
+        
+        @param  saver:()→bool                                     Save method
+        @param  preredrawer:()?→void                              Method to call before redrawing screen
+        @param  postredrawer:()?→void                             Method to call after  redrawing screen
+        @param  background:bool                                   Whether to save in the background
+        @param  spawn:(()→bool, (bool)→void)→()→(void|awaitable)  Function that calls its first argument in the background, and then
+                                                                  calls its second argument with the return value, `False` if it
+                                                                  raised an exception, it returns a function that waits for this,
+                                                                  or that returns an awaitable that waits for it if `run_async` is used
         '''
         modified = False
         override = False
+        save_queued, save_result = False, None
         
         oldy, oldx, oldmark = self.y, self.x, self.mark
         stored = ctrl('L')
         edited = False
+        last_frame = 0
         
-        def redraw():
-            print('\033[H\033[2J', end='')
-            if preredrawer is not None:
-                preredrawer()
-            for line in self.lines:
-                line.draw()
-            if postredrawer is not None:
-                postredrawer()
+        def repaint():
+            self.lines.prune(self.offy, self.offy + self.height - 2)
+            for row in range(self.height - 2):
+                if self.offy + row < len(self.lines):
+                    self.lines[self.offy + row].draw()
+                else:
+                    self.screen.put(row, 0, ' ' * (self.width + 1))
             self.realert()
             self.restatus()
         
-        def store(key, value_map, required_next = None):
-            nonlocal stored
-            if key in value_map:
-                if required_next is not None:
-                    if sys.stdin.read(1) != required_next:
-                        return False
-                stored = value_map[key]
-                return True
-            return False
+        def redraw():
+            self.output.write('\033[H\033[2J')
+            self.screen.clear()
+            if (preredrawer is not None) or (postredrawer is not None):
+                # The hooks print directly to stdout, so
+                # everything before them must be written first
+                self.output.flush()
+            if preredrawer is not None:
+                yield preredrawer
+            if postredrawer is not None:
+                yield postredrawer
+            repaint()
         
         def edit(method, error_message):
             nonlocal edited
@@ -266,11 +580,12 @@ class TextArea():
             ins_text = (' ' + _('override')) if override else ''
             above = ' +%i↑' % self.offy if self.offy > 0 else ''
             below = ' +%i↓' % below if below > 0 else ''
-            self.status(mode_text + ins_text + above + below)
+            saving_text = (' ' + _('saving…')) if self.saving is not None else ''
+            self.status(mode_text + ins_text + saving_text + above + below)
         
         def ensure_y():
             nonlocal stored
-            updates = False
+            updates, offy = False, self.offy
             if self.y < self.offy:
                 self.offy = self.y
                 updates = True
@@ -278,17 +593,462 @@ class TextArea():
                 self.offy = self.y - self.height + 3
                 updates = True
             if updates:
+                if self.scroll_regions:
+                    # The rows span the whole terminal, so they can be scrolled
+                    # on the terminal, and only the new lines have to be sent
+                    self.screen.scroll(0, self.height - 2, self.offy - offy)
+                update_status()
+                repaint()
+        
+        def save():
+            nonlocal modified, save_queued, save_result
+            if self.saving is not None:
+                # Save the latest text when the running save has finished
+                save_queued = True
+                self.alert(_('Will save when the current save has finished'))
+                return
+            self.commit_edit()
+            changes = self.dirty_fields()
+            for y in self.dirty:
+                if self.fields[y] in changes:
+                    self.datamap[self.fields[y]] = self.lines[y].text
+            if background:
+                journal = self.editring.journal
+                records = 0 if journal is None else len(journal.records)
+                self.saving = (None, changes, self.dirty)
+                (self.dirty, modified, save_result) = ({}, False, None)
                 update_status()
-                redraw()
+                self.alert(None)
+                wait = spawn(saver, lambda success : save_in_background(success, journal, records))
+                self.saving = (wait, changes, self.saving[2])
+            elif (yield saver):
+                self.dirty.clear()
+                modified = False
+                update_status()
+                self.alert(_('Saved'))
+                if self.editring.journal is not None:
+                    try:
+                        self.editring.journal.sync()
+                    except OSError:
+                        self.alert(_('Saved, but failed to save the edit history!'))
+            else:
+                self.alert(_('Failed to save!'))
         
+        def save_in_background(success, journal, records):
+            nonlocal save_result
+            save_result = (success, _('Saved'))
+            if success and (journal is not None):
+                try:
+                    journal.sync(records)
+                except OSError:
+                    save_result = (True, _('Saved, but failed to save the edit history!'))
+            self.reader.interrupt(-11)
+        
+        def saved():
+            nonlocal modified, save_queued
+            if (self.saving is None) or (save_result is None):
+                # The save has already been handled, when the user exited
+                return
+            self.saving[0]()
+            (success, message) = save_result
+            if not success:
+                # Fields that were modified before the failed save are still
+                # modified, compared to the values from before that save
+                self.dirty.update(self.saving[2])
+                (modified, message) = (True, _('Failed to save!'))
+            self.saving = None
+            update_status()
+            self.alert(message)
+            if save_queued:
+                save_queued = False
+                yield from save()
+        
+        import string
         def letter_type(char): ## XXX how do we do this with unicode support
             return (char in string.whitespace) or (char in string.punctuation)
         
+        def page_up():
+            if self.y == 0:
+                self.alert(_('At first line'))
+            elif self.y == self.offy:
+                self.offy -= self.height - 2
+                self.offy = max(0, self.offy)
+                self.y = self.offy
+                update_status()
+                repaint()
+                self.mark, self.x, self.offx = None, 0, 0
+            else:
+                self.y = self.offy
+                self.mark, self.x, self.offx = None, 0, 0
+        
+        def page_down():
+            if self.y == len(self.lines) - 1:
+                self.alert(_('At last line'))
+            elif self.y == self.offy + self.height - 3:
+                self.y += self.height - 2
+                self.y = min(self.y, len(self.lines) - 1)
+                self.offy = max(0, self.y - self.height + 3)
+                update_status()
+                repaint()
+                self.mark, self.x, self.offx = None, 0, 0
+            else:
+                self.y = self.offy + self.height - 3
+                self.y = min(self.y, len(self.lines) - 1)
+                self.mark, self.x, self.offx = None, 0, 0
+        
+        def backward_word():
+            if self.x == 0:  self.alert(_('At beginning'))
+            else:
+                x = self.x
+                text = self.lines[self.y].buffer
+                t = letter_type(text[x - 1])
+                while (x > 0) and (letter_type(text[x - 1]) == t):
+                    x -= 1
+                self.lines[self.y].move_point(x - self.x)
+        
+        def forward_word():
+            if self.x == len(self.lines[self.y].buffer):  self.alert(_('At end'))
+            else:
+                x = self.x
+                text = self.lines[self.y].buffer
+                t = letter_type(text[x])
+                while (x < len(text)) and (letter_type(text[x]) == t):
+                    x += 1
+                self.lines[self.y].move_point(x - self.x)
+        
+        def previous_line():
+            if self.y == 0:
+                self.alert(_('At first line'))
+            else:
+                self.y -= 1
+                ensure_y()
+                self.mark, self.x, self.offx = None, 0, 0
+                update_status()
+        
+        def next_line():
+            if self.y == len(self.lines) - 1:
+                self.alert(_('At last line'))
+            else:
+                self.y += 1
+                ensure_y()
+                self.mark, self.x, self.offx = None, 0, 0
+                update_status()
+        
+        def override_mode():
+            nonlocal override
+            override = not override
+            update_status()
+        
+        def select(delta):
+            if not atleast(self.mark, 0):
+                self.alert(_('Mark set'))
+                self.mark = self.x
+            if delta > 0:  move_point(1, _('At end'))
+            else:          move_point(-1, _('At beginning'))
+        
+        def set_mark():
+            if   self.mark is None:       self.mark = self.x    ; self.alert(_('Mark set'))
+            elif self.mark == ~(self.x):  self.mark = self.x    ; self.alert(_('Mark activated'))
+            elif self.mark == self.x:     self.mark = ~(self.x) ; self.alert(_('Mark deactivated'))
+            else:                         self.mark = self.x    ; self.alert(_('Mark set'))
+        
+        def copy():
+            if not self.lines[self.y].copy():
+                self.alert(_('No text is selected'))
+        
+        def yank_cycle():
+            nonlocal edited
+            if not self.lines[self.y].yank_cycle():
+                edit(lambda L : L.yank(), _('Killring is empty'))
+            else:
+                edited = True
+        
+        def undo():
+            nonlocal edited
+            self.commit_edit()
+            popped = self.editring.pop()
+            if popped is None:
+                self.alert(_('Nothing to undo' if self.editring.editdir < 0 else 'Nothing to redo'))
+                return
+            (change, undone) = popped
+            buffer = self.lines[change.y].buffer
+            matches = buffer[change.x : change.x + len(change.deleted)] == change.deleted
+            matches = matches and (change.x <= len(buffer))
+            matches = matches and (change.new_x <= len(buffer) - len(change.deleted) + len(change.inserted))
+            if not matches:
+                # The history was loaded from a journal that does not match the document
+                self.alert(_('Edit history does not match the text'))
+                return
+            self.alert(_('Undo!' if undone else 'Redo!'))
+            self.touch(self.lines[change.y])
+            self.lines[change.y].buffer.replace(change.x, change.x + len(change.deleted), change.inserted)
+            self.mark, self.x = None, change.new_x
+            if self.y != change.y:
+                self.y = change.y
+                ensure_y()
+            if not (self.offx <= self.x <= self.offx + self.areawidth):
+                self.offx = max(self.x - self.areawidth + 1, 0)
+            self.lines[self.y].draw()
+            edited = True
+        
+        def leave():
+            nonlocal running
+            # Wait for the save running in the background, and the save queued after it
+            failed = False
+            while self.saving is not None:
+                self.alert(_('Waiting for the current save to finish'))
+                self.flush()
+                yield self.saving[0]
+                failed = not save_result[0]
+                yield from saved()
+            if not failed:
+                running = False
+            # otherwise the text must not be lost, saved() has told the user that the save failed
+        
+        def insert(text):
+            nonlocal edited
+            if override:  self.lines[self.y].override(text)
+            else:         self.lines[self.y].insert(text)
+            edited = True
+        
+        def paste(text):
+            # Fields are single line, so line breaks and
+            # other control characters are pasted as spaces
+            import re
+            text = re.sub('[\0-\037\177]', ' ', text.rstrip('\r\n'))
+            if len(text) > 0:
+                # A paste is undone by itself, not together with what was typed around it
+                self.commit_edit()
+                insert(text)
+                self.commit_edit()
+        
+        def resize():
+            if self.resize():
+                update_status()
+                if (preredrawer is not None) or (postredrawer is not None):
+                    # We cannot know what the hooks
+                    # draw, so let them draw it again
+                    yield from redraw()
+                else:
+                    repaint()
+        
+        def run_posted():
+            while len(self.posted) > 0:
+                yield self.posted.popleft()
+            update_status()
+            repaint()
+        
+        last_query = ''
+        def isearch(backward):
+            nonlocal stored, last_query
+            if len(self.fields) == 0:
+                return
+            if self.search_index is None:
+                from pytagomacs.search import SearchIndex
+                self.search_index = SearchIndex(self.fields, self.lines.text)
+            origin = (self.y, self.x, self.mark, self.offx)
+            # The search starts at the point, positions in a field
+            # include its name, which is followed by a NUL
+            start = (self.y, len(self.fields[self.y]) + 1 + self.x)
+            query, match, failing, wrapped = '', None, False, False
+            states = []
+            def find(y, offset):
+                nonlocal match, failing
+                found = self.search_index.find(query, y, offset, backward)
+                (match, failing) = (match, True) if found is None else (found, False)
+            def show(y, x, mark):
+                old = self.y
+                self.y, self.x, self.mark = y, x, mark
+                if not (self.offx <= self.x <= self.offx + self.areawidth):
+                    self.offx = max(self.x - self.areawidth + 1, 0)
+                if self.y != old:
+                    self.commit_edit()
+                    self.lines[old].draw()
+                    ensure_y()
+                self.lines[self.y].draw()
+            while True:
+                if match is not None:
+                    (y, offset) = match
+                    x = offset - len(self.fields[y]) - 1
+                    if x < 0:
+                        # The occurrence is in the name of the field
+                        show(y, 0, None)
+                    elif backward:
+                        show(y, x, x + len(query))
+                    else:
+                        show(y, x + len(query), x)
+                prompt = 'I-search backward: ' if backward else 'I-search: '
+                if wrapped:  prompt = 'Wrapped ' + prompt
+                if failing:  prompt = 'Failing ' + prompt
+                self.alert(_(prompt) + query)
+                self.flush()
+                if self.instrumentation is not None:
+                    self.instrumentation.end(self.output)
+                d = yield None
+                if self.instrumentation is not None:
+                    self.instrumentation.begin('isearch-backward' if backward else 'isearch-forward', self.output)
+                command = None if isinstance(d, Paste) else self.keymap.get(d, None)
+                if command in ('isearch-forward', 'isearch-backward'):
+                    states.append((query, match, failing, wrapped, backward))
+                    if query == '':
+                        query = last_query
+                    if (command == 'isearch-backward') != backward:
+                        backward = not backward
+                    elif failing and (query != ''):
+                        # Continue from the other end
+                        wrapped = True
+                        if backward:
+                            last = len(self.fields) - 1
+                            find(last, len(self.fields[last]) + 1 + len(self.lines.text(last)) + 1)
+                        else:
+                            find(0, 0)
+                        continue
+                    if query == '':
+                        states.pop()
+                    elif match is None:
+                        find(*start)
+                    else:
+                        find(match[0], match[1] + (0 if backward else 1))
+                elif isinstance(d, str) and (d >= ' ') and (d != '\177'):
+                    states.append((query, match, failing, wrapped, backward))
+                    if isinstance(d, Paste):
+                        import re
+                        d = re.sub('[\0-\037\177]', ' ', d.rstrip('\r\n'))
+                    query += d
+                    # If the shorter text could not be found, neither can this
+                    if not failing:
+                        if match is None:
+                            find(*start)
+                        else:
+                            find(match[0], match[1] + (1 if backward else 0))
+                elif backspace(d):
+                    if len(states) > 0:
+                        (query, match, failing, wrapped, backward) = states.pop()
+                        if match is None:
+                            show(*origin[:3])
+                elif isinstance(d, int) and (d <= -10):
+                    # Events that are not keys do not stop the search
+                    yield from handlers[d]()
+                elif d == ctrl('G'):
+                    # Abort, and go back to where the search started
+                    show(*origin[:3])
+                    self.offx = origin[3]
+                    self.lines[self.y].draw()
+                    self.alert(None)
+                    break
+                else:
+                    # Any other key stops the search, and is used as usual unless it is a line break
+                    self.mark = None
+                    self.lines[self.y].draw()
+                    self.alert(None)
+                    if d not in ('\n', '\r'):
+                        stored = d
+                    break
+            if query != '':
+                last_query = query
+        
+        def prefix(key):
+            nonlocal stored
+            self.alert(('C-' + ctrl(key).lower()) if isinstance(key, str) and (key < ' ') else str(key))
+            self.flush()
+            if self.instrumentation is not None:
+                self.instrumentation.end(self.output)
+            d = yield None
+            if isinstance(d, str) and (len(d) > 1) and ((key, d[0]) in handlers) and not isinstance(d, Paste):
+                # A run of printable characters, that starts with a bound character
+                self.reader.unget(d[1:])
+                d = d[0]
+            if self.instrumentation is not None:
+                self.instrumentation.begin(names.get((key, d), None) or name(d), self.output)
+            handler = handlers.get((key, d), None)
+            if handler is None:
+                stored = d
+                self.alert(None)
+            else:
+                rc = handler()
+                if rc is not None:
+                    yield from rc
+        
+        commands = {
+            'page-up'           : page_up,
+            'page-down'         : page_down,
+            'backward-word'     : backward_word,
+            'forward-word'      : forward_word,
+            'previous-line'     : previous_line,
+            'next-line'         : next_line,
+            'forward-char'      : lambda : move_point(1, _('At end')),
+            'backward-char'     : lambda : move_point(-1, _('At beginning')),
+            'end-of-line'       : lambda : move_point(len(self.lines[self.y].buffer) - self.x, _('At end')),
+            'beginning-of-line' : lambda : move_point(-(self.x), _('At beginning')),
+            'override-mode'     : override_mode,
+            'select-backward'   : lambda : select(-1),
+            'select-forward'    : lambda : select(1),
+            'set-mark'          : set_mark,
+            'swap-mark'         : lambda : self.alert(_('Mark swapped' if self.lines[self.y].swap_mark() else 'No mark is activated')),
+            'copy'              : copy,
+            'delete'            : lambda : edit(lambda L : L.delete(), _('At end')),
+            'erase'             : lambda : edit(lambda L : L.erase(),  _('At beginning')),
+            'kill'              : lambda : edit(lambda L : L.kill(),   _('At end')),
+            'cut'               : lambda : edit(lambda L : L.cut(),    _('No text is selected')),
+            'yank'              : lambda : edit(lambda L : L.yank(),   _('Killring is empty')),
+            'yank-cycle'        : yank_cycle,
+            'undo'              : undo,
+            'change-direction'  : lambda : self.editring.change_direction(),
+            'isearch-forward'   : lambda : isearch(False),
+            'isearch-backward'  : lambda : isearch(True),
+            'redraw'            : redraw,
+            'save'              : save,
+            'exit'              : leave,
+        }
+        
+        # Resolve the key bindings once, so that each key is dispatched with one lookup
+        handlers = {-10 : resize, -11 : saved, -12 : run_posted}
+        names = {-10 : 'resize', -11 : 'saved', -12 : 'posted'}
+        unknown = []
+        for key, command in self.keymap.items():
+            if isinstance(command, str):
+                if command not in commands:
+                    unknown.append(command)
+                    continue
+                (handlers[key], names[key]) = (commands[command], command)
+            elif command is not None:
+                (handlers[key], names[key]) = ((lambda function : lambda : function(self))(command), 'function')
+        for key in self.keymap:
+            if isinstance(key, tuple) and (key in handlers):
+                (handlers[key[0]], names[key[0]]) = ((lambda key : lambda : prefix(key))(key[0]), 'prefix')
+        if len(unknown) > 0:
+            self.alert(_('Unknown command in the key bindings: %s') % ', '.join(sorted(set(unknown))))
+        
+        # Printable keys are read in runs, they must be split at bound printable keys
+        bound = [key for key in handlers if isinstance(key, str) and (len(key) == 1) and (key >= ' ') and (key != '\177')]
+        if len(bound) > 0:
+            import re
+            bound = re.compile('[%s]' % ''.join(re.escape(key) for key in bound))
+        else:
+            bound = None
+        def split(d):
+            if (bound is None) or not isinstance(d, str) or (len(d) < 2) or (d[0] < ' ') or isinstance(d, Paste):
+                return d
+            found = bound.search(d)
+            if found is None:
+                return d
+            i = max(found.start(), 1)
+            self.reader.unget(d[i:])
+            return d[:i]
+        
+        def name(d):
+            rc = names.get(d, None) if not isinstance(d, Paste) else 'paste'
+            if (rc is None) and isinstance(d, str) and (d >= ' ') and (d != '\177'):
+                rc = 'insert'
+            return rc
+        
+        running = True
         update_status()
-        while True:
+        while running:
             if atleast(oldmark, 0) or atleast(self.mark, 0):
                 self.lines[self.y].draw()
             if self.y != oldy:
+                self.commit_edit()
                 self.lines[oldy].draw()
                 self.lines[self.y].draw()
             oldy, oldx, oldmark = self.y, self.x, self.mark
@@ -297,187 +1057,37 @@ class TextArea():
                 if not modified:
                     modified = True
                     update_status()
-            sys.stdout.flush()
-            d = sys.stdin.read(1) if stored is None else stored
+            if stored is None:
+                # Only show the latest state when keys arrive faster than they
+                # are handled, or faster than the maximum frame rate, but show
+                # something now and then while the keys keep coming
+                now = time.monotonic()
+                wait = 0.0 if MAX_FRAME_RATE is None else last_frame + 1 / MAX_FRAME_RATE - now
+                if (not self.coalesce) or (now - last_frame >= 1 / MIN_FRAME_RATE) or not (yield max(float(wait), 0.0)):
+                    self.flush()
+                    last_frame = time.monotonic()
+                    if self.instrumentation is not None:
+                        self.instrumentation.end(self.output)
+                d = split((yield None))
+                if self.instrumentation is not None:
+                    self.instrumentation.begin(name(d), self.output)
+            else:
+                # The key has already been measured, by the command that did not use it
+                d = split(stored)
             stored = None
             if self.alerted:
                 self.alert(None)
-            if d == -1: # page up
-                if self.y == 0:
-                    self.alert(_('At first line'))
-                elif self.y == self.offy:
-                    self.offy -= self.height - 2
-                    self.offy = max(0, self.offy)
-                    self.y = self.offy
-                    update_status()
-                    redraw()
-                    self.mark, self.x, self.offx = None, 0, 0
-                else:
-                    self.y = self.offy
-                    self.mark, self.x, self.offx = None, 0, 0
-            elif d == -2: # page down
-                if self.y == len(self.lines) - 1:
-                    self.alert(_('At last line'))
-                elif self.y == self.offy + self.height - 3:
-                    self.y += self.height - 2
-                    self.y = min(self.y, len(self.lines) - 1)
-                    self.offy = max(0, self.y - self.height + 3)
-                    update_status()
-                    redraw()
-                    self.mark, self.x, self.offx = None, 0, 0
-                else:
-                    self.y = self.offy + self.height - 3
-                    self.y = min(self.y, len(self.lines) - 1)
-                    self.mark, self.x, self.offx = None, 0, 0
-            elif d == -3:
-                if self.x == 0:  self.alert(_('At beginning'))
-                else:
-                    x = self.x
-                    text = self.lines[self.y].text
-                    t = letter_type(text[x - 1])
-                    while (x > 0) and (letter_type(text[x - 1]) == t):
-                        x -= 1
-                    self.lines[self.y].move_point(x - self.x)
-            elif d == -4:
-                if self.x == len(self.lines[self.y].text):  self.alert(_('At end'))
-                else:
-                    x = self.x
-                    text = self.lines[self.y].text
-                    t = letter_type(text[x])
-                    while (x < len(text)) and (letter_type(text[x]) == t):
-                        x += 1
-                    self.lines[self.y].move_point(x - self.x)
-            elif d == ctrl('@'):
-                if   self.mark is None:       self.mark = self.x    ; self.alert(_('Mark set'))
-                elif self.mark == ~(self.x):  self.mark = self.x    ; self.alert(_('Mark activated'))
-                elif self.mark == self.x:     self.mark = ~(self.x) ; self.alert(_('Mark deactivated'))
-                else:                         self.mark = self.x    ; self.alert(_('Mark set'))
-            elif backspace(d):    edit(lambda L : L.erase(), _('At beginning'))
-            elif d == ctrl('K'):  edit(lambda L : L.kill(),  _('At end'))
-            elif d == ctrl('W'):  edit(lambda L : L.cut(),   _('No text is selected'))
-            elif d == ctrl('Y'):  edit(lambda L : L.yank(),  _('Killring is empty'))
-            elif d == ctrl('R'):  self.editring.change_direction()
-            elif d in (ctrl('_'), ctrl('U')):
-                ## TODO history break
-                if self.editring.is_empty():
-                    self.alert(_('Nothing to undo'))
-                else:
-                    (edit, undo) = self.editring.pop()
-                    self.alert(_('Undo!' if undo else 'Redo!'))
-                    fix_offx = not (self.offx <= edit.x < self.offx + self.areawidth)
-                    text = self.lines[edit.y]
-                    if edit.deleted is not None:
-                        a, b = max(edit.old_x, edit.new_x), min(edit.old_x, edit.new_x)
-                        text = text[:a] + text[b:]
-                    if edit.inserted is not None:
-                        text = text[:edit.old_x] + edit.inserted + text[edit.old_x:]
-                    self.lines[edit.x] = text
-                    self.x = edit.new_x
-                    if self.y != edit.y:
-                        self.mark = None
-                        fix_offx = True
-                        self.y = edit.y
-                    if fix_offx:
-                        self.offx = max(edit.x - self.areawidth + 1, 0)
-                        self.lines[self.y].draw()
-                    if not (self.offy <= edit.y < self.offy + self.height - 2):
-                        ensure_y()
-            elif d == ctrl('X'):
-                self.alert('C-x')
-                sys.stdout.flush()
-                d = sys.stdin.read(1)
-                self.alert(str(ord(d)))
-                sys.stdout.flush()
-                if d == ctrl('X'):
-                    self.alert(_('Mark swapped' if self.lines[self.y].swap_mark() else 'No mark is activated'))
-                elif d == ctrl('S'):
-                    last = ''
-                    for row in range(0, len(self.lines)):
-                        self.datamap[self.lines[row].name] = self.lines[row].text
-                    if saver():
-                        modified = False
-                        update_status()
-                        self.alert(_('Saved'))
-                    else:
-                        self.alert(_('Failed to save!'))
-                elif d == ctrl('C'):
-                    break
-                else:
-                    stored = d
-                    self.alert(None)
-            elif ord(d) < ord(' '):
-                if d == ctrl('P'):
-                    if self.y == 0:
-                        self.alert(_('At first line'))
-                    else:
-                        self.y -= 1
-                        ensure_y()
-                        self.mark, self.x, self.offx = None, 0, 0
-                        update_status()
-                elif d == ctrl('N'):
-                    if self.y == len(self.lines) - 1:
-                        self.alert(_('At last line'))
-                    else:
-                        self.y += 1
-                        ensure_y()
-                        self.mark, self.x, self.offx = None, 0, 0
-                        update_status()
-                elif d == ctrl('D'):  edit(lambda L : L.delete(), _('At end'))
-                elif d == ctrl('F'):  move_point(1, _('At end'))
-                elif d == ctrl('E'):  move_point(len(self.lines[self.y].text) - self.x, _('At end'))
-                elif d == ctrl('B'):  move_point(-1, _('At beginning'))
-                elif d == ctrl('A'):  move_point(-(self.x), _('At beginning'))
-                elif d == ctrl('L'):  redraw()
-                elif d == '\033':
-                    d = sys.stdin.read(1)
-                    if d == '[':
-                        d = sys.stdin.read(1)
-                        if store(d, {'C':ctrl('F'), 'D':ctrl('B'), 'A':ctrl('P'), 'B':ctrl('N')}): pass
-                        elif store(d, {'3':ctrl('D'), '4':ctrl('E'), '5':-1, '6':-2}, '~'): pass
-                        elif d == '1':
-                            d = sys.stdin.read(1)
-                            if d == '~':  stored = ctrl('A')
-                            elif d == ';':
-                                d = sys.stdin.read(1)
-                                if d == '5':   store(sys.stdin.read(1), {'C':-4, 'D':-3, 'A':-1, 'B':-2}) # ctrl
-                                elif d == '2': # shift
-                                    store(sys.stdin.read(1), {'C':ctrl('F'), 'D':ctrl('B')})
-                                    if stored is not None:
-                                        if not atleast(self.mark, 0):
-                                            self.alert(_('Mark set'))
-                                            self.mark = self.x
-                                        if stored == ctrl('F'):  move_point(1, _('At end'))
-                                        else:                    move_point(-1, _('At beginning'))
-                                        stored = None
-                        elif d == '2':
-                            if sys.stdin.read(1) == '~':
-                                override = not override
-                                update_status()
-                        else:
-                            while True:
-                                d = sys.stdin.read(1)
-                                if ord('a') <= ord(d.lower()) <= ord('z'): break
-                                if d == '~': break
-                    elif d == 'O':  store(sys.stdin.read(1), {'H':ctrl('A'), 'F':ctrl('E')})
-                    elif store(d, {'P':-1, 'p':-1, 'N':-2, 'n':-2, 'B':-3, 'b':-3, 'F':-4, 'f':-4}): pass
-                    elif d.lower() == 'w':
-                        if not self.lines[self.y].copy():
-                            self.alert(_('No text is selected'))
-                    elif d.lower() == 'y':
-                        if not self.lines[self.y].yank_cycle():
-                            stored = ctrl('Y')
-                        else:
-                            edited = True
-                elif d == '\n':
-                    stored = ctrl('N')
-            else:
-                insert = d
-                if len(insert) == 0:
-                    continue
-                if override:  self.lines[self.y].override(insert)
-                else:         self.lines[self.y].insert(insert)
-                edited = True
-
+            if isinstance(d, Paste):
+                paste(d)
+                continue
+            handler = handlers.get(d, None)
+            if handler is not None:
+                rc = handler()
+                if rc is not None:
+                    # The command needs to wait for something
+                    yield from rc
+            elif isinstance(d, str) and (d >= ' ') and (d != '\177'):
+                insert(d)
 
 if __name__ == '__main__': # For testing
     def phonysaver():
@@ -18,6 +18,7 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
+import sys
 
 
 
@@ -26,18 +27,21 @@ class Edit():
     A line edit
     '''
     
-    def __init__(self, deleted, inserted, y, old_x, new_x):
+    __slots__ = ('deleted', 'inserted', 'y', 'old_x', 'new_x', 'x')
+    
+    def __init__(self, deleted, inserted, y, old_x, new_x, x):
         '''
         Constructor
         
-        @param  deleted:str?   The text deleted by the edit
-        @param  inserted:str?  The text inserted by the edit
-        @param  y:int          The index of the line the edit was made one
-        @param  old_x:int      The position on the line before the edit was made
-        @param  new_x:int      The position on the line after the edit was made
+        @param  deleted:str   The text deleted by the edit
+        @param  inserted:str  The text inserted by the edit
+        @param  y:int         The index of the line the edit was made one
+        @param  old_x:int     The position on the line before the edit was made
+        @param  new_x:int     The position on the line after the edit was made
+        @param  x:int         The position on the line where the text was deleted and inserted
         '''
         self.deleted, self.inserted = deleted, inserted
-        self.y, self.old_x, self.new_x = y, old_x, new_x
+        self.y, self.old_x, self.new_x, self.x = y, old_x, new_x, x
     
     
     def reverse(self):
@@ -46,22 +50,49 @@ class Edit():
         
         @return  :Edit  The object's opposite
         '''
-        return Edit(self.inserted, self.deleted, self.y, self.new_x, self.new_y)
+        return Edit(self.inserted, self.deleted, self.y, self.new_x, self.old_x, self.x)
 
 
 
 class Editring():
     '''
     Editing ring class
+    
+    The ring is stored in a list that is used as a circular buffer once it
+    is full, `editstart` is the index of the oldest edit, and `editptr`
+    is relative to it, so pushing and evicting are O(1)
+    
+    If the editring has a journal, the history in the journal is loaded the
+    first time an edit is pushed or popped, and every push and pop is recorded
     '''
     
-    def __init__(self, limit = 100):
+    INTERN_LIMIT = 64
+    '''
+    :int  Texts in edits up to this length are interned, so that repeated texts share memory
+    '''
+    
+    def __init__(self, limit = 100, journal = None):
         '''
         Constructor
         
-        @param  limit:int  The maximum size of the ring
+        @param  limit:int         The maximum size of the ring
+        @param  journal:Journal?  The journal of the document, `None` if the history is not persistent
         '''
         self.editring, self.editmax, self.editptr, self.editdir = [], limit, 0, -1
+        self.editstart, self.editcount, self.journal = 0, 0, journal
+        self.loaded = journal is None
+    
+    
+    def load(self):
+        '''
+        Load the history from the journal, unless already loaded
+        '''
+        if not self.loaded:
+            (self.loaded, journal, self.journal) = (True, self.journal, None)
+            try:
+                journal.load(self)
+            finally:
+                self.journal = journal
     
     
     def is_empty(self):
@@ -70,7 +101,17 @@ class Editring():
         
         @return  :bool  Whether the editring is empty
         '''
-        return len(self.editring) == 0
+        return self.editcount == 0
+    
+    
+    def get(self, index):
+        '''
+        Get an edit
+        
+        @param   index:int  The index of the edit, 0 for the oldest
+        @return  :Edit      The edit
+        '''
+        return self.editring[(self.editstart + index) % len(self.editring)]
     
     
     def change_direction(self):
@@ -82,32 +123,57 @@ class Editring():
     
     def push(self, edit):
         '''
-        Insert a new edit to the editring
+        Insert a new edit to the editring, edits that have
+        been undone can no longer be redone after this
         
         @param  edit:Edit  The edit to insert
         '''
+        if not self.loaded:
+            self.load()
         self.editdir = -1
-        self.editring[:] = self.editring[:self.editptr] + [edit] + self.editring[self.editptr:]
-        if len(self.editring) > self.editmax:
-            i = (self.editptr + self.editmax // 2) % self.editmax
-            self.editring[:] = self.editring[:i] + self.editring[i + 1:]
+        if self.editmax <= 0:
+            return
+        if self.journal is not None:
+            self.journal.push(edit)
+        if len(edit.deleted) <= Editring.INTERN_LIMIT:
+            edit.deleted = sys.intern(edit.deleted)
+        if len(edit.inserted) <= Editring.INTERN_LIMIT:
+            edit.inserted = sys.intern(edit.inserted)
+        n = len(self.editring)
+        # Forget undone edits, each edit is only forgotten once so this is amortised O(1)
+        for i in range(self.editptr, self.editcount):
+            self.editring[(self.editstart + i) % n] = None
+        self.editcount = self.editptr
+        if self.editcount == self.editmax:
+            self.editring[self.editstart] = None
+            self.editstart = (self.editstart + 1) % n
+            self.editcount -= 1
+        if self.editcount < n:
+            self.editring[(self.editstart + self.editcount) % n] = edit
+        else:
+            self.editring.append(edit)
+        self.editcount += 1
+        self.editptr = self.editcount
     
     
     def pop(self):
         '''
         Get the next undo or redo
         
-        @return  :(Edit, bool)?  The edit to preform (not reverse) and whether it is a undo
-        '''
-        if is_empty():
-            return None
-        if self.editptr < 0:
-            self.editptr = min(1, len(self.editring))
-            self.editdir = 1
-        elif self.editptr == len(self.editring):
-            self.editptr = max(1, len(self.editring) - 2)
-            self.editdir = -1
-        edit = self.editring[self.editptr]
-        self.editptr += self.editdir
-        return (edit, True) if self.editdir < 0 else (edit.reverse(), False)
-
+        @return  :(Edit, bool)?  The edit to perform, and whether it is a undo, `None` if there is nothing to undo or redo
+        '''
+        if not self.loaded:
+            self.load()
+        if self.editdir < 0:
+            if self.editptr == 0:
+                return None
+            self.editptr -= 1
+            rc = (self.get(self.editptr).reverse(), True)
+        else:
+            if self.editptr == self.editcount:
+                return None
+            self.editptr += 1
+            rc = (self.get(self.editptr - 1), False)
+        if self.journal is not None:
+            self.journal.pop(rc[1])
+        return rc
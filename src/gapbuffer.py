@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+pytagomacs – An Emacs like key–value editor library for Python
+
+Copyright © 2013, 2014  Mattias Andrée (maandree@member.fsf.org)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+
+class GapBuffer():
+    '''
+    Text buffer with a gap at the position of the last edit, so
+    that repeated edits at the same position are cheap
+    
+    The text before the gap is stored in order, and the text after
+    the gap is stored reversed, so that both sides grow and shrink at
+    the end of a list. The buffer is not split until it is first edited.
+    '''
+    
+    def __init__(self, text = ''):
+        '''
+        Constructor
+        
+        @param  text:str  The initial text
+        '''
+        self.string, self.before, self.after = text, None, None
+    
+    
+    def __len__(self):
+        '''
+        Get the length of the text
+        
+        @return  :int  The number of characters in the text
+        '''
+        if self.before is None:
+            return len(self.string)
+        return len(self.before) + len(self.after)
+    
+    
+    def __str__(self):
+        '''
+        Get the text, it is cached until the next edit
+        
+        @return  :str  The text
+        '''
+        if self.string is None:
+            self.string = ''.join(self.before) + ''.join(reversed(self.after))
+        return self.string
+    
+    
+    def __getitem__(self, index):
+        '''
+        Get a character or a substring
+        
+        @param   index:int|slice  The index of the character, or the range of the substring
+        @return  :str             The character or substring
+        '''
+        if self.string is not None:
+            return self.string[index]
+        n, m = len(self.before), len(self.after)
+        if isinstance(index, slice):
+            (start, stop, step) = index.indices(n + m)
+            if step != 1:
+                return str(self)[index]
+            head = ''.join(self.before[start : min(stop, n)]) if start < n else ''
+            if stop <= n:
+                return head
+            tail = self.after[m - (stop - n) : m - (max(start, n) - n)]
+            return head + ''.join(reversed(tail))
+        if index < 0:
+            index += n + m
+        if not 0 <= index < n + m:
+            raise IndexError('string index out of range')
+        return self.before[index] if index < n else self.after[m - 1 - (index - n)]
+    
+    
+    def replace(self, start, end, text):
+        '''
+        Replace a part of the text
+        
+        @param  start:int  The index of the first character to replace
+        @param  end:int    The index of the character after the last character to replace
+        @param  text:str   The text to insert in place of the replaced text
+        '''
+        if self.before is None:
+            self.before, self.after = list(self.string), []
+        # Move the gap to the end of the replaced text
+        n = len(self.before)
+        if end < n:
+            self.after.extend(reversed(self.before[end:]))
+            del self.before[end:]
+        elif end > n:
+            moved = self.after[len(self.after) - (end - n):]
+            del self.after[len(self.after) - (end - n):]
+            self.before.extend(reversed(moved))
+        del self.before[start:]
+        self.before.extend(text)
+        self.string = None
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+pytagomacs – An Emacs like key–value editor library for Python
+
+Copyright © 2013, 2014  Mattias Andrée (maandree@member.fsf.org)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import time
+
+from pytagomacs.common import *
+
+
+
+KINDS = {
+    'page-up' : 'navigation',  'page-down' : 'navigation',  'backward-word' : 'navigation',  'forward-word' : 'navigation',
+    'previous-line' : 'navigation',  'next-line' : 'navigation',  'forward-char' : 'navigation',  'backward-char' : 'navigation',
+    'end-of-line' : 'navigation',  'beginning-of-line' : 'navigation',  'select-backward' : 'navigation',
+    'select-forward' : 'navigation',  'set-mark' : 'navigation',  'swap-mark' : 'navigation',
+    'insert' : 'insert',  'paste' : 'insert',  'delete' : 'insert',  'erase' : 'insert',  'override-mode' : 'insert',
+    'copy' : 'kill',  'kill' : 'kill',  'cut' : 'kill',  'yank' : 'kill',  'yank-cycle' : 'kill',
+    'undo' : 'undo',  'change-direction' : 'undo',  'isearch-forward' : 'search',  'isearch-backward' : 'search',
+    'redraw' : 'redraw',  'resize' : 'redraw',  'posted' : 'redraw',  'save' : 'save',  'saved' : 'save',
+}
+'''
+:dict<str, str>  Commands mapped to the kind of key they are counted as, text that is typed is counted as the
+                 command 'insert', pasted text as 'paste', and keys that run functions as 'function', keys
+                 that follow a prefix key as the command they are bound to together with the prefix key,
+                 the events 'resize', 'saved' and 'posted' are counted as commands, and commands that
+                 are not listed, including 'prefix', and keys that are not bound, are counted as 'other'
+'''
+
+
+
+class Histogram():
+    '''
+    Histogram with buckets for each power of two
+    '''
+    
+    def __init__(self):
+        '''
+        Constructor
+        '''
+        self.buckets, self.count, self.total, self.maximum = [], 0, 0, 0
+    
+    
+    def add(self, value):
+        '''
+        Add a value to the histogram
+        
+        @param  value:int  The value, must be non-negative
+        '''
+        i = value.bit_length()
+        if i >= len(self.buckets):
+            self.buckets.extend([0] * (i + 1 - len(self.buckets)))
+        self.buckets[i] += 1
+        self.count += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+    
+    
+    def report(self):
+        '''
+        Summarise the histogram
+        
+        @return  :dict<str, int|float|dict<str, int>>  The number of values, their mean and maximum, and
+                                                       the number of values in each non-empty bucket, the
+                                                       buckets are labelled with their exclusive upper bound
+        '''
+        buckets = dict(('<%i' % (1 << i), n) for (i, n) in enumerate(self.buckets) if n > 0)
+        mean = self.total / self.count if self.count > 0 else 0
+        return {'count' : self.count, 'mean' : mean, 'max' : self.maximum, 'buckets' : buckets}
+
+
+
+class Instrumentation():
+    '''
+    Statistics about how long each key takes to handle, from when it has been
+    read until the terminal has been updated, and how much is written to the
+    terminal for it, collected in histograms for each kind of key, when keys
+    arrive faster than the screen is updated, the keys that are shown in the
+    same frame share the bytes and writes of that frame
+    '''
+    
+    def __init__(self, path = None):
+        '''
+        Constructor
+        
+        @param  path:str?  The file the statistics are written to when the text area is closed, `None` for none
+        '''
+        self.path, self.kinds, self.pending, self.written, self.writes = path, {}, [], 0, 0
+    
+    
+    def begin(self, command, output):
+        '''
+        Start measuring a key, it is measured until the next frame has been shown
+        
+        @param  command:str?   The name of the command the key is bound to, `None` if it is not bound
+        @param  output:Output  The output the terminal is updated through
+        '''
+        if len(self.pending) == 0:
+            self.written, self.writes = output.written, output.writes
+        self.pending.append((KINDS.get(command, 'other'), time.perf_counter()))
+    
+    
+    def end(self, output):
+        '''
+        Stop measuring the keys that have been read since the last frame,
+        if any, should be called when a frame has been shown
+        
+        @param  output:Output  The output the terminal is updated through
+        '''
+        if len(self.pending) == 0:
+            return
+        now, n = time.perf_counter(), len(self.pending)
+        size, count = output.written - self.written, output.writes - self.writes
+        for i, (kind, started) in enumerate(self.pending):
+            if kind not in self.kinds:
+                self.kinds[kind] = (Histogram(), Histogram(), Histogram())
+            (latencies, sizes, writes) = self.kinds[kind]
+            latencies.add(int((now - started) * 1000000))
+            # Split the frame evenly between the keys
+            sizes.add(size // n + (1 if i < size % n else 0))
+            writes.add(count // n + (1 if i < count % n else 0))
+        self.pending = []
+    
+    
+    def report(self):
+        '''
+        Get the statistics
+        
+        @return  :dict<str, dict<str, dict>>  For each kind of key, histogram summaries of the latency in
+                                              microseconds ('latency'), the number of bytes written to the
+                                              terminal ('bytes'), and the number of writes ('writes')
+        '''
+        rc = {}
+        for kind, (latencies, sizes, writes) in self.kinds.items():
+            rc[kind] = {'latency' : latencies.report(), 'bytes' : sizes.report(), 'writes' : writes.report()}
+        return rc
+    
+    
+    def dump(self, path = None):
+        '''
+        Write the statistics to a file, as JSON
+        
+        @param  path:str?  The file, `None` for the file selected in the constructor
+        '''
+        import json
+        with open(self.path if path is None else path, 'w') as file:
+            json.dump(self.report(), file, indent = 4, sort_keys = True)
+            file.write('\n')
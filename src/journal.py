@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+pytagomacs – An Emacs like key–value editor library for Python
+
+Copyright © 2013, 2014  Mattias Andrée (maandree@member.fsf.org)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os
+import json
+
+from pytagomacs.common import *
+from pytagomacs.editring import *
+
+
+
+def journal_path(document):
+    '''
+    Get the pathname of the journal for a document
+    
+    @param   document:str  The document's ID
+    @return  :str          The pathname of the journal file
+    '''
+    from urllib.parse import quote
+    directory = cache_directory() if JOURNAL_DIRECTORY is None else JOURNAL_DIRECTORY
+    name = quote(document, safe = '')
+    if len(name) > 200:
+        # Most file systems do not allow file names longer than 255 bytes
+        import hashlib
+        name = hashlib.sha256(document.encode('utf-8')).hexdigest()
+    return os.path.join(directory, name + '.journal')
+
+
+
+def is_edit_record(record):
+    '''
+    Check whether a decoded record is a well-formed edit record
+    
+    @param   record:list  The record, its first element must be `"e"`
+    @return  :bool        Whether the record has the fields of an edit record, with the right types
+    '''
+    if len(record) != 7:
+        return False
+    if not all(isinstance(record[i], str) for i in (1, 5, 6)):
+        return False
+    return all((type(record[i]) is int) and (record[i] >= 0) for i in (2, 3, 4))
+
+
+
+class Journal():
+    '''
+    Append-only file with the edit history of a document
+    
+    Each line in the file is a JSON array, either `["e", field, x, old_x, new_x, deleted, inserted]`
+    for an edit pushed to the editring, `["u"]` for an undo or `["r"]` for a redo.
+    Records are kept in memory until `sync` is called, which is done when the document is saved,
+    so that the journal always describes how the saved document was reached.
+    '''
+    
+    def __init__(self, path, fields):
+        '''
+        Constructor
+        
+        @param  path:str          The pathname of the journal file
+        @param  fields:list<str>  Field names, in the order lines are indexed
+        '''
+        self.path, self.fields, self.records = path, fields, []
+    
+    
+    def load(self, editring):
+        '''
+        Replay the journal into an editring, and compact the journal file if most of
+        its records are obsolete, the history is left empty if the journal cannot be read
+        
+        If an edit cannot be replayed, because it is malformed or its field no longer
+        exists, the replay stops there, since the following undos and redos would be
+        applied to the wrong edits, and the journal is rewritten to match the editring
+        
+        @param  editring:Editring  The editring, should be empty and not be connected to the journal
+        '''
+        try:
+            with open(self.path, 'rb') as file:
+                data = file.read().decode('utf-8', 'replace')
+        except OSError:
+            return
+        indices = dict((name, y) for (y, name) in enumerate(self.fields))
+        count, stopped = 0, False
+        for line in data.split('\n'):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Empty line, or a record that was not fully written
+                continue
+            if (not isinstance(record, list)) or (len(record) == 0):
+                continue
+            count += 1
+            if record[0] == 'e':
+                if (not is_edit_record(record)) or (record[1] not in indices):
+                    stopped = True
+                    break
+                (_, name, x, old_x, new_x, deleted, inserted) = record
+                editring.push(Edit(deleted, inserted, indices[name], old_x, new_x, x))
+            elif record == ['u']:
+                editring.pop()
+            elif record == ['r']:
+                editring.change_direction()
+                editring.pop()
+                editring.change_direction()
+        editring.editdir = -1
+        if stopped or (count > 2 * max(editring.editmax, 16)):
+            self.compact(editring)
+    
+    
+    def compact(self, editring):
+        '''
+        Replace the journal file with the shortest journal that describes an editring
+        
+        @param  editring:Editring  The editring
+        '''
+        records = [self.encode_edit(editring.get(i)) for i in range(editring.editcount)]
+        records += [json.dumps(['u']) + '\n'] * (editring.editcount - editring.editptr)
+        temporary = self.path + '.tmp'
+        try:
+            with open(temporary, 'wb') as file:
+                file.write(''.join(records).encode('utf-8'))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary, self.path)
+        except OSError:
+            # Keep the old journal, the history that has been loaded is still usable
+            try:
+                os.unlink(temporary)
+            except OSError:
+                pass
+    
+    
+    def encode_edit(self, edit):
+        '''
+        Encode an edit as a record
+        
+        @param   edit:Edit  The edit
+        @return  :str       The record, including the line break
+        '''
+        record = ['e', self.fields[edit.y], edit.x, edit.old_x, edit.new_x, edit.deleted, edit.inserted]
+        return json.dumps(record, ensure_ascii = False) + '\n'
+    
+    
+    def push(self, edit):
+        '''
+        Record that an edit was pushed to the editring
+        
+        @param  edit:Edit  The edit
+        '''
+        self.records.append(self.encode_edit(edit))
+    
+    
+    def pop(self, undo):
+        '''
+        Record that an edit was undone or redone
+        
+        @param  undo:bool  Whether the edit was undone
+        '''
+        self.records.append('["u"]\n' if undo else '["r"]\n')
+    
+    
+    def sync(self, count = None):
+        '''
+        Write the records to the journal file, and wait until they are on disk
+        
+        @param  count:int?  The number of records, from the oldest, to write, `None` for all
+        '''
+        records = self.records if count is None else self.records[:count]
+        if len(records) == 0:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok = True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            data = ''.join(records).encode('utf-8')
+            while len(data) > 0:
+                data = data[os.write(fd, data):]
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        del self.records[:len(records)]
@@ -20,18 +20,121 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 
+class SpillFile():
+    '''
+    An anonymous temporary file that holds all killed texts that are stored in a
+    file rather than in memory, so that only one file is open however many texts
+    there are, the space of removed texts is reclaimed by moving the remaining
+    texts to the beginning of the file when at least half of the file is unused
+    '''
+    
+    def __init__(self):
+        '''
+        Constructor, the file is not created until the first text is added
+        '''
+        self.file, self.size, self.unused, self.spills = None, 0, 0, set()
+    
+    
+    def add(self, data):
+        '''
+        Store a text
+        
+        @param   data:bytes  The text, encoded in UTF-8
+        @return  :Spill      The stored text
+        '''
+        if self.file is None:
+            import tempfile
+            self.file = tempfile.TemporaryFile()
+        self.file.seek(self.size)
+        self.file.write(data)
+        spill = Spill(self.size, len(data))
+        self.size += len(data)
+        self.spills.add(spill)
+        return spill
+    
+    
+    def read(self, spill):
+        '''
+        Read a stored text
+        
+        @param   spill:Spill  The text
+        @return  :str         The text
+        '''
+        self.file.seek(spill.offset)
+        return self.file.read(spill.length).decode('utf-8')
+    
+    
+    def remove(self, spill):
+        '''
+        Forget a stored text
+        
+        @param  spill:Spill  The text
+        '''
+        self.spills.discard(spill)
+        self.unused += spill.length
+        if len(self.spills) == 0:
+            self.file.close()
+            self.file, self.size, self.unused = None, 0, 0
+        elif self.unused * 2 >= self.size:
+            self.compact()
+    
+    
+    def compact(self):
+        '''
+        Move the texts to the beginning of the file, and truncate it
+        '''
+        pos = 0
+        for spill in sorted(self.spills, key = lambda spill : spill.offset):
+            if spill.offset != pos:
+                # The texts are moved towards the beginning, so a text is never
+                # overwritten before it has been moved
+                self.file.seek(spill.offset)
+                data = self.file.read(spill.length)
+                self.file.seek(pos)
+                self.file.write(data)
+                spill.offset = pos
+            pos += spill.length
+        self.file.truncate(pos)
+        self.size, self.unused = pos, 0
+
+
+
+class Spill():
+    '''
+    A killed text that is stored in a `SpillFile` rather than in memory
+    '''
+    
+    def __init__(self, offset, length):
+        '''
+        Constructor
+        
+        @param  offset:int  The position of the text in the file
+        @param  length:int  The number of bytes in the text, encoded in UTF-8
+        '''
+        self.offset, self.length = offset, length
+
+
+
 class Killring():
     '''
     Killring class
+    
+    The ring is stored in a list that is used as a circular buffer once it
+    is full, `killstart` is the index of the oldest item, and `killptr`
+    is relative to it, so adding, evicting and cycling are all O(1)
     '''
     
-    def __init__(self, limit = 50):
+    def __init__(self, limit = 50, budget = None, spill = None):
         '''
         Constructor
         
-        @param  limit:int  The maximum size of the killring
+        @param  limit:int    The maximum size of the killring
+        @param  budget:int?  The maximum number of bytes the texts kept in memory may use, `None` for no limit
+        @param  spill:int?   The number of bytes at which texts are stored in a temporary file instead of in memory
         '''
-        self.killring, self.killmax, self.killptr = [], limit, 0
+        self.killring, self.killmax, self.killptr, self.killstart = [], limit, 0, 0
+        self.killcount, self.killbudget, self.killspill, self.killbytes = 0, budget, spill, 0
+        self.killfile = SpillFile()
     
     
     def add(self, text):
@@ -40,9 +143,47 @@ class Killring():
         
         @param  text:str  The text to add
         '''
-        self.killring.append(text)
-        if len(self.killring) > self.killmax:
-            self.killring[:] = self.killring[1:]
+        if self.killmax <= 0:
+            return
+        size = 0
+        if (self.killbudget is not None) or (self.killspill is not None):
+            data = text.encode('utf-8')
+            size = len(data)
+            if (self.killspill is not None) and (len(data) >= self.killspill):
+                try:
+                    (text, size) = (self.killfile.add(data), 0)
+                except OSError:
+                    # Keep the text in memory if it cannot be written
+                    pass
+        if self.killcount == self.killmax:
+            self.evict()
+        n = len(self.killring)
+        if self.killcount < n:
+            self.killring[(self.killstart + self.killcount) % n] = (text, size)
+        elif self.killstart == 0:
+            self.killring.append((text, size))
+        else:
+            # The ring has shrunk because of the budget, grow it back
+            self.killring.insert(self.killstart, (text, size))
+            self.killstart += 1
+        self.killcount += 1
+        self.killbytes += size
+        if self.killbudget is not None:
+            while (self.killbytes > self.killbudget) and (self.killcount > 1):
+                self.evict()
+    
+    
+    def evict(self):
+        '''
+        Remove the oldest text in the killring
+        '''
+        (text, size) = self.killring[self.killstart]
+        if isinstance(text, Spill):
+            self.killfile.remove(text)
+        self.killring[self.killstart] = None
+        self.killstart = (self.killstart + 1) % len(self.killring)
+        self.killcount -= 1
+        self.killbytes -= size
     
     
     def is_empty(self):
@@ -51,14 +192,14 @@ class Killring():
         
         @return  :bool  Whether the killring is empty
         '''
-        return len(self.killring) == 0
+        return self.killcount == 0
     
     
     def reset(self):
         '''
         Resets the killring pointer
         '''
-        self.killptr = len(self.killring) - 1
+        self.killptr = self.killcount - 1
     
     
     def next(self):
@@ -67,7 +208,7 @@ class Killring():
         '''
         self.killptr -= 1
         if self.killptr < 0:
-            self.killptr += len(self.killring)
+            self.killptr += self.killcount
     
     
     def get(self):
@@ -76,5 +217,23 @@ class Killring():
         
         @return  :str  The current item in the killring
         '''
-        return self.killring[self.killptr]
+        text = self.killring[(self.killstart + self.killptr) % len(self.killring)][0]
+        return self.killfile.read(text) if isinstance(text, Spill) else text
+
+
+if __name__ == '__main__': # Measure the cost of killing and yanking
+    import time
+    for limit in (50, 5000, 500000):
+        killring, n = Killring(limit), 200000
+        start = time.monotonic()
+        for i in range(2 * limit + n):
+            killring.add('kill %i' % i)
+        adding = (time.monotonic() - start) / (2 * limit + n)
+        killring.reset()
+        start = time.monotonic()
+        for _ in range(n):
+            killring.next()
+            killring.get()
+        cycling = (time.monotonic() - start) / n
+        print('limit %6i:  add %.3f µs,  yank-cycle %.3f µs' % (limit, adding * 1e6, cycling * 1e6))
 
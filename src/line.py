@@ -19,6 +19,7 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 from pytagomacs.common import *
+from pytagomacs.gapbuffer import *
 
 
 class Line():
@@ -38,7 +39,18 @@ class Line():
         '''
         self.area, self.name, self.text, self.y = area, name, text, y
         self.killring = self.area.killring
-        self.jump = lambda x : Jump(self.area.top + self.y - self.area.offy, self.area.left + self.area.innerleft + x)
+    
+    
+    @property
+    def text(self):
+        '''
+        The text in the line, built from the buffer when it is read after an edit
+        '''
+        return str(self.buffer)
+    
+    @text.setter
+    def text(self, text):
+        self.buffer = (GapBuffer if LINE_BUFFER is None else LINE_BUFFER)(text)
     
     
     def is_active(self):
@@ -50,6 +62,20 @@ class Line():
         return self.area.y == self.y
     
     
+    def replace(self, start, end, text):
+        '''
+        Replace a part of the text, all edits of the text go through this
+        method, so that they are recorded in the undo history
+        
+        @param  start:int  The index of the first character to replace
+        @param  end:int    The index of the character after the last character to replace
+        @param  text:str   The text to insert in place of the replaced text
+        '''
+        self.area.record_edit(self, start, end, text)
+        self.area.touch(self)
+        self.buffer.replace(start, end, text)
+    
+    
     def has_selection(self):
         '''
         Checks if there is any text selected, assuming the line is focused
@@ -63,21 +89,19 @@ class Line():
         '''
         Redraw the line
         '''
-        if 0 <= self.y - self.area.offy < self.area.height - 2:
+        row = self.y - self.area.offy
+        if 0 <= row < self.area.height - 2:
+            screen, innerleft, areawidth = self.area.screen, self.area.innerleft, self.area.areawidth
             leftside = ACTIVE_COLOUR if self.is_active() else INACTIVE_COLOUR
-            if leftside is not None:
-                leftside = '%s\033[%sm%s:\033[00m' % (self.jump(-(self.area.innerleft)), leftside, self.name)
-            else:
-                leftside = '%s%s:' % (self.jump(-(self.area.innerleft)), self.name)
-            text = (self.text[self.area.offx if self.is_active() else 0:] + ' ' * self.area.areawidth)[:self.area.areawidth]
+            screen.put(row, 0, self.name + ':', leftside)
+            screen.put(row, len(self.name) + 1, ' ' * (innerleft - len(self.name) - 1))
+            offx = self.area.offx if self.is_active() else 0
+            text = (self.buffer[offx : offx + areawidth] + ' ' * areawidth)[:areawidth]
+            screen.put(row, innerleft, text)
             if self.is_active() and atleast(self.area.mark, 0):
                 (a, b) = self.area.get_selection(True)
                 if a != b:
-                    if SELECTED_COLOUR is not None:
-                        text = text[:a] + ('\033[%sm%s\033[00m' % (SELECTED_COLOUR, text[a : b])) + text[b:]
-            print('%s%s%s' % (leftside, self.jump(0), text), end='')
-            if self.is_active():
-                self.jump(self.area.x - self.area.offx)()
+                    screen.put(row, innerleft + a, text[a : b], SELECTED_COLOUR)
     
     
     def copy(self):
@@ -86,16 +110,16 @@ class Line():
         
         @return  :bool  Whether any text select, and therefore copied
         '''
-        if self.has_selection():
+        self.area.begin_edit(True)
+        rc = self.has_selection()
+        if rc:
             (a, b) = self.area.get_selection()
-            self.killring.add(self.text[a : b])
+            self.killring.add(self.buffer[a : b])
             self.killring.reset()
-            (a, b) = self.area.get_selection(True)
-            text = self.text[self.area.offx:][:self.area.areawidth][a : b]
-            print('%s%s' % (self.jump(a), text), end='')
             self.area.mark = None
-            return True
-        return False
+            self.draw()
+        self.area.end_edit(True)
+        return rc
     
     
     def cut(self):
@@ -104,12 +128,14 @@ class Line():
         
         @return  :bool  Whether any text select, and therefore cut
         '''
+        self.area.begin_edit(True)
         mark, x = self.area.mark, self.area.x
-        if self.copy():
+        rc = self.copy()
+        if rc:
             self.area.mark, self.area.x = mark, x
             self.delete()
-            return True
-        return False
+        self.area.end_edit(True)
+        return rc
     
     
     def kill(self):
@@ -118,11 +144,13 @@ class Line():
         
         @return  :bool  Whether the point was not at the end of the line, and therefore a cut was made
         '''
-        if self.area.x < len(self.text):
-            self.area.mark = len(self.text)
+        self.area.begin_edit(True)
+        rc = self.area.x < len(self.buffer)
+        if rc:
+            self.area.mark = len(self.buffer)
             self.cut()
-            return True
-        return False
+        self.area.end_edit(True)
+        return rc
     
     
     def delete(self):
@@ -131,28 +159,23 @@ class Line():
         
         @return  :bool  The point was not at the end of the line or something was selected, and therefore a deletion was made
         '''
-        removed = 0
+        self.area.begin_edit(False)
+        rc = True
         if self.has_selection():
             (a, b) = self.area.get_selection()
-            self.text = self.text[:a] + self.text[b:]
+            self.replace(a, b, '')
             self.area.x = a
-            if self.area.offx > len(self.text):
-                self.area.offx = max(len(self.text) - self.area.areawidth, 0)
-                self.area.mark = None
-                print('%s%s' % (self.jump(0), ' ' * self.area.areawidth), end='')
-                self.draw()
-                return True
-            removed = b - a
+            if self.area.offx > len(self.buffer):
+                self.area.offx = max(len(self.buffer) - self.area.areawidth, 0)
+        elif self.area.x == len(self.buffer):
+            rc = False
+        else:
+            self.replace(self.area.x, self.area.x + 1, '')
         self.area.mark = None
-        if removed == 0:
-            if self.area.x == len(self.text):
-                return False
-            removed = 1
-            self.text = self.text[:self.area.x] + self.text[self.area.x + 1:]
-        text = self.text[self.area.offx:][:self.area.areawidth]
-        a = limit(0, self.area.x - self.area.offx, self.area.areawidth)
-        print('%s%s%s' % (self.jump(a), text[a:] + ' ' * removed, self.jump(a)), end='')
-        return True
+        if rc:
+            self.draw()
+        self.area.end_edit(False)
+        return rc
     
     
     def erase(self):
@@ -161,17 +184,20 @@ class Line():
         
         @return  :bool  Whether point as at the beginning of the line or any text was selected, and therefore an erasure was made
         '''
+        self.area.begin_edit(False)
+        rc = True
         if not self.has_selection():
             self.area.mark = None
             if self.area.x == 0:
-                return False
-            self.area.x -= 1
-            if self.area.x < self.area.offx:
-                self.area.offx = max(self.area.offx - self.area.areawidth, 0)
-                self.draw()
-                self.jump(self.area.x - self.area.offx)()
-        self.delete()
-        return True
+                rc = False
+            else:
+                self.area.x -= 1
+                if self.area.x < self.area.offx:
+                    self.area.offx = max(self.area.offx - self.area.areawidth, 0)
+        if rc:
+            self.delete()
+        self.area.end_edit(False)
+        return rc
     
     
     def yank(self):
@@ -180,18 +206,18 @@ class Line():
         
         @return  :bool  Whether the killring was not empty, and therefor a yank was made
         '''
-        if self.killring.is_empty():
-            return False
-        self.area.mark = None
-        yanked = self.killring.get()
-        self.text = self.text[:self.area.x] + yanked + self.text[self.area.x:]
-        self.area.x += len(yanked)
-        if self.area.x > self.area.offx + self.area.areawidth:
-            self.area.offx = len(self.text) - self.area.areawidth
-        print('%s%s' % (self.jump(0), ' ' * self.area.areawidth), end='')
-        self.draw()
-        self.jump(self.area.x - self.area.offx)()
-        return True
+        self.area.begin_edit(False)
+        rc = not self.killring.is_empty()
+        if rc:
+            self.area.mark = None
+            yanked = self.killring.get()
+            self.replace(self.area.x, self.area.x, yanked)
+            self.area.x += len(yanked)
+            if self.area.x > self.area.offx + self.area.areawidth:
+                self.area.offx = len(self.buffer) - self.area.areawidth
+            self.draw()
+        self.area.end_edit(False)
+        return rc
     
     
     def yank_cycle(self):
@@ -200,16 +226,18 @@ class Line():
         
         @return  :bool  False on failure, which happens if the killring is empty or if the text before the point is not the yanked text
         '''
-        if self.killring.is_empty():
-            return False
-        yanked = self.killring.get()
-        if self.text[max(self.area.x - len(yanked), 0) : self.area.x] != yanked:
-            return False
-        self.area.mark = self.area.x - len(yanked)
-        self.delete()
-        self.killring.next()
-        self.yank()
-        return True
+        self.area.begin_edit(False)
+        rc = False
+        if not self.killring.is_empty():
+            yanked = self.killring.get()
+            if self.buffer[max(self.area.x - len(yanked), 0) : self.area.x] == yanked:
+                self.area.mark = self.area.x - len(yanked)
+                self.delete()
+                self.killring.next()
+                self.yank()
+                rc = True
+        self.area.end_edit(False)
+        return rc
     
     
     def move_point(self, delta):
@@ -219,23 +247,20 @@ class Line():
         @param   delta:int  The number of steps to move the point to the right
         @return  :bool      Whether the point has been moved
         '''
+        self.area.begin_edit(True)
         x = self.area.x + delta
-        if 0 <= x <= len(self.text):
+        rc = 0 <= x <= len(self.buffer)
+        if rc:
             self.area.x = x
-            if delta < 0:
-                if self.area.offx > self.area.x:
-                    self.area.offx = max(self.area.x - 3 * self.area.areawidth // 4, 0)
-                    self.draw()
-                else:
-                    print('\033[%iD' % -delta, end='')
-            elif delta > 0:
-                if self.area.x - self.area.offx > self.area.areawidth:
-                    self.area.offx = self.area.x - self.area.areawidth // 4
-                    self.draw()
-                else:
-                    print('\033[%iC' % delta, end='')
-            return delta != 0
-        return False
+            if (delta < 0) and (self.area.offx > self.area.x):
+                self.area.offx = max(self.area.x - 3 * self.area.areawidth // 4, 0)
+                self.draw()
+            elif (delta > 0) and (self.area.x - self.area.offx > self.area.areawidth):
+                self.area.offx = self.area.x - self.area.areawidth // 4
+                self.draw()
+            rc = delta != 0
+        self.area.end_edit(True)
+        return rc
     
     
     def swap_mark(self):
@@ -244,10 +269,12 @@ class Line():
         
         @return  :bool  Whether the mark was set, and therefore as swap was made
         '''
-        if atleast(self.area.mark, 0):
+        self.area.begin_edit(True)
+        rc = atleast(self.area.mark, 0)
+        if rc:
             self.area.mark, self.area.x = self.area.x, self.area.mark
-            return True
-        return False
+        self.area.end_edit(True)
+        return rc
     
     
     def override(self, insert, override = True):
@@ -257,26 +284,19 @@ class Line():
         @param  insert:str     The text to insert
         @param  override:bool  Whether to override
         '''
+        self.area.begin_edit(False)
         if atleast(self.area.mark, 0):
             self.area.mark = ~(self.area.mark)
-        if len(insert) == 0:
-            return
-        a, b = self.area.x, self.area.x
-        if override:
-            b = min(self.area.x + len(insert), len(self.text))
-        self.text = self.text[:a] + insert + self.text[b:]
-        oldx = self.area.x
-        self.area.x += len(insert)
-        if self.area.x - self.area.offx < self.area.areawidth:
-            if not override:
-                print('%s\033[%iP' % (self.jump(self.area.areawidth - len(insert)), len(insert)), end='')
-                print('%s\033[%i@' % (self.jump(oldx - self.area.offx), len(insert)), end='')
-            print(insert, end='')
-        else:
-            self.area.offx = self.area.x - self.area.areawidth // 4
-            self.jump(0)()
-            print(' ' * self.area.areawidth, end='')
+        if len(insert) > 0:
+            a, b = self.area.x, self.area.x
+            if override:
+                b = min(self.area.x + len(insert), len(self.buffer))
+            self.replace(a, b, insert)
+            self.area.x += len(insert)
+            if self.area.x - self.area.offx >= self.area.areawidth:
+                self.area.offx = self.area.x - self.area.areawidth // 4
             self.draw()
+        self.area.end_edit(False)
     
     
     def insert(self, insert):
@@ -287,3 +307,84 @@ class Line():
         '''
         self.override(insert, False)
 
+
+
+
+class Lines():
+    '''
+    The lines in a text area, created when they are first used
+    '''
+    
+    def __init__(self, area):
+        '''
+        Constructor
+        
+        @param  area:TextArea  The text area
+        '''
+        self.area, self.lines = area, {}
+    
+    
+    def __len__(self):
+        '''
+        Get the number of lines
+        
+        @return  :int  The number of fields in the text area
+        '''
+        return len(self.area.fields)
+    
+    
+    def __getitem__(self, y):
+        '''
+        Get a line, create it if it has not been used before
+        
+        @param   y:int  The index of the line
+        @return  :Line  The line
+        '''
+        line = self.lines.get(y, None)
+        if line is None:
+            if not 0 <= y < len(self.area.fields):
+                raise IndexError('line index out of range')
+            name = self.area.fields[y]
+            line = Line(self.area, name, self.area.datamap[name] if name in self.area.datamap else '', y)
+            self.lines[y] = line
+        return line
+    
+    
+    def text(self, y):
+        '''
+        Get the text of a line, without creating the line
+        
+        @param   y:int  The index of the line
+        @return  :str   The text of the line
+        '''
+        line = self.lines.get(y, None)
+        if line is not None:
+            return line.text
+        name = self.area.fields[y]
+        return self.area.datamap[name] if name in self.area.datamap else ''
+    
+    
+    def created(self):
+        '''
+        Get all lines that have been created, lines that
+        have not been created still have their value in
+        the data map
+        
+        @return  :itr<Line>  The created lines
+        '''
+        return self.lines.values()
+    
+    
+    def prune(self, start, end):
+        '''
+        Forget unmodified lines outside a range, they will be recreated when used again
+        
+        @param  start:int  The index of the first line to keep
+        @param  end:int    The index of the line after the last line to keep
+        '''
+        datamap = self.area.datamap
+        for y in [y for y in self.lines if not start <= y < end]:
+            line = self.lines[y]
+            value = datamap[line.name] if line.name in datamap else ''
+            if (len(line.buffer) == len(value)) and (line.text == value):
+                del self.lines[y]
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+pytagomacs – An Emacs like key–value editor library for Python
+
+Copyright © 2013, 2014  Mattias Andrée (maandree@member.fsf.org)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os
+import sys
+
+
+class Output():
+    '''
+    Terminal output buffer, collects everything printed during
+    a keystroke so that it can be written with a single system call
+    
+    `written` and `writes` count the bytes and the number of writes that
+    have been sent to the terminal, not including unbuffered output to stdout
+    '''
+    
+    def __init__(self, buffered = True, sink = None):
+        '''
+        Constructor
+        
+        @param  buffered:bool  Whether to buffer the output until `flush` is invoked,
+                               rather than printing it as soon as it is written
+        @param  sink:¿W?       Binary file-like object to write to instead of stdout, `None` for stdout
+        '''
+        self.buffered, self.buffer, self.sink = buffered, [], sink
+        self.written, self.writes = 0, 0
+    
+    
+    def write(self, text):
+        '''
+        Write text to the terminal
+        
+        @param  text:str  The text, may include escape sequences
+        '''
+        if self.buffered:
+            self.buffer.append(text)
+        elif self.sink is None:
+            print(text, end='')
+        else:
+            data = text.encode('utf-8')
+            self.sink.write(data)
+            self.written, self.writes = self.written + len(data), self.writes + 1
+    
+    
+    def flush(self):
+        '''
+        Write everything that has been buffered to the terminal
+        '''
+        if self.sink is None:
+            # Anything printed directly to stdout, for example by redraw
+            # hooks, must reach the terminal before our buffer does
+            sys.stdout.flush()
+        if len(self.buffer) == 0:
+            return
+        if self.sink is not None:
+            data = ''.join(self.buffer).encode('utf-8')
+            self.buffer.clear()
+            self.sink.write(data)
+            self.written, self.writes = self.written + len(data), self.writes + 1
+            return
+        data = ''.join(self.buffer).encode(sys.stdout.encoding or 'utf-8', 'replace')
+        self.buffer.clear()
+        self.written, self.writes = self.written + len(data), self.writes + 1
+        fd = sys.stdout.fileno()
+        while len(data) > 0:
+            data = data[os.write(fd, data):]
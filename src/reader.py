@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+pytagomacs – An Emacs like key–value editor library for Python
+
+Copyright © 2013, 2014  Mattias Andrée (maandree@member.fsf.org)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os
+import sys
+import codecs
+import select
+from collections import deque
+
+from pytagomacs.common import *
+
+
+
+SEQUENCES = {
+    '\033[A' : ctrl('P'),   '\033[B' : ctrl('N'),   '\033[C' : ctrl('F'),   '\033[D' : ctrl('B'),
+    '\033[1~' : ctrl('A'),  '\033[3~' : ctrl('D'),  '\033[4~' : ctrl('E'),
+    '\033[5~' : -1,         '\033[6~' : -2,         '\033[2~' : -5,
+    '\033[1;5A' : -1,       '\033[1;5B' : -2,       '\033[1;5D' : -3,       '\033[1;5C' : -4,
+    '\033[1;2D' : -6,       '\033[1;2C' : -7,
+    '\033OH' : ctrl('A'),   '\033OF' : ctrl('E'),
+    '\033P' : -1,  '\033p' : -1,  '\033N' : -2,  '\033n' : -2,
+    '\033B' : -3,  '\033b' : -3,  '\033F' : -4,  '\033f' : -4,
+    '\033W' : -8,  '\033w' : -8,  '\033Y' : -9,  '\033y' : -9,
+}
+'''
+:dict<str, str|int>  Escape sequences mapped to the key they are read as, the key is either
+                     a control character or one of the following values:
+                     
+                     -1  Page up            -2  Page down
+                     -3  Previous word      -4  Next word
+                     -5  Toggle override    -6  Select left      -7  Select right
+                     -8  Copy               -9  Yank from next in killring
+                     
+                     -10 is used for when the terminal has been resized,
+                     -11 for when a save in the background has finished, and
+                     -12 for when functions have been posted to the text area
+'''
+
+
+
+class Paste(str):
+    '''
+    Text pasted while bracketed paste mode is enabled, read as one key
+    '''
+
+
+
+class Reader():
+    '''
+    Terminal input reader, reads all available input at once and
+    splits it into keys, where runs of printable characters are
+    combined into one key
+    '''
+    
+    PRINTABLE = None
+    '''
+    :Pattern  Runs of printable characters, compiled when the first reader is created
+    '''
+    
+    def __init__(self, fd = None, sequences = None, source = None):
+        '''
+        Constructor
+        
+        @param  fd:int?                        The file descriptor to read from, `None` for stdin
+        @param  sequences:dict<str, str|int>?  Recognised escape sequences, `None` for `SEQUENCES`
+        @param  source:itr<bytes>?             Input to read instead of the file descriptor, one item per
+                                               read, when it is exhausted it is read as end of file
+        '''
+        if Reader.PRINTABLE is None:
+            import re
+            Reader.PRINTABLE = re.compile('[^\0-\037\177]+')
+        self.source = None if source is None else iter(source)
+        self.fd = sys.stdin.fileno() if (fd is None) and (source is None) else fd
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self.pending, self.keys, self.paste = '', deque(), None
+        self.interrupts, self.pipe = deque(), None
+        # Build a tree from the escape sequences, so that
+        # they can be parsed one character at a time
+        self.tree = {}
+        for sequence, key in (SEQUENCES if sequences is None else sequences).items():
+            node = self.tree
+            for c in sequence[:-1]:
+                node = node.setdefault(c, {})
+            node[sequence[-1]] = key
+    
+    
+    def start(self):
+        '''
+        Make it possible to interrupt a wait for input
+        '''
+        if self.pipe is None:
+            self.pipe = os.pipe()
+            os.set_blocking(self.pipe[0], False)
+            os.set_blocking(self.pipe[1], False)
+    
+    
+    def stop(self):
+        '''
+        Release the resources allocated by `start`
+        '''
+        if self.pipe is not None:
+            os.close(self.pipe[0])
+            os.close(self.pipe[1])
+            self.pipe = None
+    
+    
+    def interrupt(self, key):
+        '''
+        Inject a key and wake up `get` if it is waiting for input,
+        this is safe to call from a signal handler
+        
+        @param  key:str|int  The key
+        '''
+        self.interrupts.append(key)
+        if self.pipe is not None:
+            try:
+                os.write(self.pipe[1], b'\0')
+            except BlockingIOError:
+                pass
+    
+    
+    def get(self):
+        '''
+        Get the next key, wait for input if there is none
+        
+        @return  :str|int  The next key
+        '''
+        while (len(self.keys) == 0) and (len(self.interrupts) == 0):
+            if self.source is not None:
+                self.read()
+                continue
+            fds = [self.fd] if self.pipe is None else [self.fd, self.pipe[0]]
+            if self.fd in select.select(fds, [], [])[0]:
+                self.read()
+            else:
+                self.drain()
+        return self.next()
+    
+    
+    def has_input(self, timeout = 0):
+        '''
+        Check whether there is input that has not been returned by `get`
+        
+        @param   timeout:float  The number of seconds to wait for input if there is none
+        @return  :bool          Whether there is input
+        '''
+        if (len(self.keys) > 0) or (len(self.interrupts) > 0):
+            return True
+        if self.source is not None:
+            data = next(self.source, None)
+            if data is None:
+                return False
+            self.feed(data)
+            return True
+        return len(select.select([self.fd], [], [], timeout)[0]) > 0
+    
+    
+    def next(self):
+        '''
+        Get the next key without waiting for input
+        
+        @return  :str|int?  The next key, `None` if there is none
+        '''
+        if len(self.interrupts) > 0:
+            return self.interrupts.popleft()
+        if len(self.keys) > 0:
+            return self.keys.popleft()
+        return None
+    
+    
+    def unget(self, key):
+        '''
+        Put back a key, it will be returned before the keys that have not been returned yet
+        
+        @param  key:str|int  The key
+        '''
+        self.keys.appendleft(key)
+    
+    
+    def read(self):
+        '''
+        Read and parse the available input, should only be
+        called when it is known that there is input to read
+        '''
+        data = os.read(self.fd, 4096) if self.source is None else next(self.source, b'')
+        if len(data) == 0:
+            raise EOFError()
+        self.feed(data)
+    
+    
+    def drain(self):
+        '''
+        Empty the pipe used to interrupt waits for input
+        '''
+        if self.pipe is not None:
+            try:
+                os.read(self.pipe[0], 4096)
+            except BlockingIOError:
+                pass
+    
+    
+    def feed(self, data):
+        '''
+        Parse input
+        
+        @param  data:bytes  The input, need not end at the end of a key
+        '''
+        text = self.pending + self.decoder.decode(data)
+        i, n = 0, len(text)
+        while i < n:
+            c = text[i]
+            if self.paste is not None:
+                j = text.find('\033[201~', i)
+                if j < 0:
+                    # Keep what could be the beginning of the end marker
+                    j = max(i, n - 5)
+                    self.paste.append(text[i : j])
+                    i = j
+                    break
+                self.paste.append(text[i : j])
+                self.keys.append(Paste(''.join(self.paste)))
+                self.paste = None
+                i = j + 6
+            elif text.startswith('\033[200~', i):
+                self.paste = []
+                i += 6
+            elif c == '\033':
+                (key, length) = self.parse_escape(text, i)
+                if length is None:
+                    break
+                if key is not None:
+                    self.keys.append(key)
+                i += length
+            elif (c < ' ') or (c == '\177'):
+                self.keys.append(c)
+                i += 1
+            else:
+                j = Reader.PRINTABLE.match(text, i).end()
+                self.keys.append(text[i : j])
+                i = j
+        self.pending = text[i:]
+    
+    
+    def parse_escape(self, text, start):
+        '''
+        Parse an escape sequence
+        
+        @param   text:str           The input
+        @param   start:int          The position of the escape character
+        @return  :(str|int?, int?)  The key, `None` if not recognised, and the length of
+                                    the sequence, `None` if the sequence is incomplete
+        '''
+        node, i, n = self.tree, start, len(text)
+        while True:
+            if i == n:
+                return (None, None)
+            if text[i] not in node:
+                break
+            node = node[text[i]]
+            i += 1
+            if not isinstance(node, dict):
+                return (node, i - start)
+        # Skip unrecognised sequences
+        if i == start + 1:
+            return (None, 2)
+        if text[start + 1] == '[':
+            i = start + 2
+            while True:
+                if i == n:
+                    return (None, None)
+                if '@' <= text[i] <= '~':
+                    return (None, i + 1 - start)
+                i += 1
+        return (None, i + 1 - start)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+pytagomacs – An Emacs like key–value editor library for Python
+
+Copyright © 2013, 2014  Mattias Andrée (maandree@member.fsf.org)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+
+class Screen():
+    '''
+    Damage tracking renderer, keeps a copy of what is displayed in
+    a region of the terminal and only sends the cells that change
+    '''
+    
+    def __init__(self, output, top, left, height, width):
+        '''
+        Constructor
+        
+        @param  output:Output  The output buffer to write to
+        @param  top:int        Top  position of the region, 1 based
+        @param  left:int       Left position of the region, 1 based
+        @param  height:int     The number of rows in the region
+        @param  width:int      The number of columns in the region
+        '''
+        self.output, self.top, self.left, self.height, self.width = output, top, left, height, width
+        # The frame being drawn
+        self.text = [[' '] * width for _ in range(height)]
+        self.attr = [[None] * width for _ in range(height)]
+        # The frame on the terminal, `None` for cells with unknown content
+        self.shown_text = [[None] * width for _ in range(height)]
+        self.shown_attr = [[None] * width for _ in range(height)]
+        self.dirty = set(range(height))
+        self.cursor, self.shown_cursor = (0, 0), None
+        # The scroll that has not been sent yet, as (start, end, lines)
+        self.scrolling = None
+    
+    
+    def clear(self):
+        '''
+        Blank the frame, and record that the terminal region has been cleared
+        '''
+        self.text = [[' '] * self.width for _ in range(self.height)]
+        self.attr = [[None] * self.width for _ in range(self.height)]
+        self.shown_text = [[' '] * self.width for _ in range(self.height)]
+        self.shown_attr = [[None] * self.width for _ in range(self.height)]
+        self.dirty = set()
+        self.shown_cursor, self.scrolling = None, None
+    
+    
+    def resize(self, height, width):
+        '''
+        Change the size of the region, cells that are still inside the region
+        are assumed to still be displayed unless the number of rows changed,
+        as the terminal may then have scrolled
+        
+        @param  height:int  The new number of rows in the region
+        @param  width:int   The new number of columns in the region
+        '''
+        def fit(rows, blank):
+            rows = [(row + [blank] * width)[:width] for row in rows[:height]]
+            return rows + [[blank] * width for _ in range(height - len(rows))]
+        self.text, self.attr = fit(self.text, ' '), fit(self.attr, None)
+        if height == self.height:
+            self.shown_text, self.shown_attr = fit(self.shown_text, None), fit(self.shown_attr, None)
+        else:
+            self.shown_text = [[None] * width for _ in range(height)]
+            self.shown_attr = [[None] * width for _ in range(height)]
+        self.height, self.width = height, width
+        self.dirty = set(range(height))
+        # The rows that were to be scrolled will be drawn in full instead
+        self.shown_cursor, self.scrolling = None, None
+    
+    
+    def scroll(self, start, end, lines):
+        '''
+        Scroll rows on the terminal using a scroll region, so that only the rows
+        scrolled into view need to be drawn, the rows must span the whole width
+        of the terminal
+        
+        Nothing is sent until `render` is called, and consecutive scrolls of
+        the same rows are sent as one scroll, by the net number of rows
+        
+        @param  start:int  The first row to scroll, 0 based and relative to the region
+        @param  end:int    The row after the last row to scroll
+        @param  lines:int  The number of rows to move the text up, negative to move it down
+        '''
+        if (lines == 0) or (end <= start):
+            return
+        if self.scrolling is not None:
+            if self.scrolling[:2] == (start, end):
+                lines += self.scrolling[2]
+            else:
+                self.output.write(self.send_scroll())
+        self.scrolling = (start, end, lines)
+        self.dirty.update(range(start, end))
+    
+    
+    def send_scroll(self):
+        '''
+        Apply the scroll that has not been sent yet to the copy of what is
+        displayed, and get the escape sequences that scroll the terminal
+        
+        @return  :str  The escape sequences, empty if nothing is to be scrolled
+        '''
+        if self.scrolling is None:
+            return ''
+        (start, end, lines), self.scrolling = self.scrolling, None
+        n = abs(lines)
+        if (n == 0) or (n >= end - start):
+            # Everything is scrolled out of view, just draw the new rows over the old rows
+            return ''
+        for rows, blank in ((self.shown_text, ' '), (self.shown_attr, None)):
+            exposed = [[blank] * self.width for _ in range(n)]
+            if lines > 0:
+                rows[start : end] = rows[start + n : end] + exposed
+            else:
+                rows[start : end] = exposed + rows[start : end - n]
+        # Setting the scroll region moves the cursor
+        self.shown_cursor = None
+        return '\033[%i;%ir\033[%i%s\033[r' % (self.top + start, self.top + end - 1, n, 'S' if lines > 0 else 'T')
+    
+    
+    def put(self, y, x, text, colour = None):
+        '''
+        Draw a text on the frame, it will be truncated at the edge of the region
+        
+        @param  y:int         The row, 0 based and relative to the region
+        @param  x:int         The column, 0 based and relative to the region
+        @param  text:str      The text, may not include escape sequences
+        @param  colour:str?   The colour of the text
+        '''
+        if not 0 <= y < self.height:
+            return
+        text = text[:max(self.width - x, 0)]
+        self.text[y][x : x + len(text)] = text
+        self.attr[y][x : x + len(text)] = [colour] * len(text)
+        self.dirty.add(y)
+    
+    
+    def move(self, y, x):
+        '''
+        Select where the cursor should be placed
+        
+        @param  y:int  The row, 0 based and relative to the region
+        @param  x:int  The column, 0 based and relative to the region
+        '''
+        self.cursor = (y, x)
+    
+    
+    def render(self):
+        '''
+        Write the cells that differ from what is on the terminal to the output
+        '''
+        buf = [self.send_scroll()]
+        cursor, colour = self.shown_cursor, None
+        for y in sorted(self.dirty):
+            text, attr = self.text[y], self.attr[y]
+            shown_text, shown_attr = self.shown_text[y], self.shown_attr[y]
+            x = 0
+            while x < self.width:
+                if (text[x] == shown_text[x]) and (attr[x] == shown_attr[x]):
+                    x += 1
+                    continue
+                # Extend the damaged run over short stretches of unchanged
+                # cells, when that is cheaper than jumping over them
+                end, same = x, 0
+                while (end < self.width) and (same <= 4):
+                    if (text[end] == shown_text[end]) and (attr[end] == shown_attr[end]):
+                        same += 1
+                    else:
+                        same = 0
+                    end += 1
+                end -= same
+                if cursor != (y, x):
+                    buf.append('\033[%i;%iH' % (self.top + y, self.left + x))
+                for i in range(x, end):
+                    if attr[i] != colour:
+                        colour = attr[i]
+                        buf.append('\033[00m' if colour is None else '\033[00;%sm' % colour)
+                    buf.append(text[i])
+                shown_text[x : end] = text[x : end]
+                shown_attr[x : end] = attr[x : end]
+                # The terminal may wrap after the last column
+                cursor = (y, end) if end < self.width else None
+                x = end
+        self.dirty.clear()
+        if colour is not None:
+            buf.append('\033[00m')
+        if cursor != self.cursor:
+            buf.append('\033[%i;%iH' % (self.top + self.cursor[0], self.left + self.cursor[1]))
+        self.shown_cursor = self.cursor
+        buf = ''.join(buf)
+        if len(buf) > 0:
+            self.output.write(buf)
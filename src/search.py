@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+pytagomacs – An Emacs like key–value editor library for Python
+
+Copyright © 2013, 2014  Mattias Andrée (maandree@member.fsf.org)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+from bisect import bisect_right
+from array import array
+
+from pytagomacs.common import *
+
+
+
+def ngrams(text):
+    '''
+    Get the bytes and pairs of bytes in a text, every text that contains
+    another text also contains all of the other text's bytes and pairs
+    
+    @param   text:str   The text
+    @return  :set<int>  The bytes, and pairs of bytes, in the text encoded in UTF-8, a pair
+                        is read as one native 16-bit integer, so pairs without NUL cannot
+                        be confused with the bytes, and pairs with NUL can only be confused
+                        with the other byte of the pair, which is also in the text
+    '''
+    data = text.encode('utf-8')
+    rc = set(data)
+    rc.update(array('H', data[: len(data) & ~1]))
+    rc.update(array('H', data[1 : 1 + ((len(data) - 1) & ~1)]))
+    return rc
+
+
+
+class SearchIndex():
+    '''
+    Index of the names and values of the fields in a text area, for incremental
+    search, the fields are joined into blocks of text that are searched with
+    `str.find`, blocks that do not contain all bytes and pairs of bytes in the
+    searched text are skipped, a block is rebuilt when it is searched after
+    one of its fields has been changed
+    
+    Positions in a field are positions in its name and value joined with a NUL
+    '''
+    
+    def __init__(self, fields, value, block_size = 256):
+        '''
+        Constructor
+        
+        @param  fields:list<str>  The names of the fields
+        @param  value:(int)→str   Function that returns the current value of a field
+        @param  block_size:int    The number of fields in each block
+        '''
+        self.fields, self.value, self.block_size = fields, value, block_size
+        self.blocks = [None] * ((len(fields) + block_size - 1) // block_size)
+    
+    
+    def invalidate(self, y):
+        '''
+        Record that the value of a field has changed, or is about to change
+        
+        @param  y:int  The index of the field
+        '''
+        self.blocks[y // self.block_size] = None
+    
+    
+    def block(self, b):
+        '''
+        Get a block, it is built if it has not been built since it was last invalidated
+        
+        @param   b:int                        The index of the block
+        @return  :(str, list<int>, set<int>)  The fields in the block, in lower case and separated by NUL, the position
+                                              in the text where each field starts, and the `ngrams` of the text
+        '''
+        rc = self.blocks[b]
+        if rc is None:
+            entries, starts, pos = [], [], 0
+            for y in range(b * self.block_size, min((b + 1) * self.block_size, len(self.fields))):
+                entry = self.fields[y] + '\0' + self.value(y)
+                folded = entry.lower()
+                # Keep the case if lowering it changes the length, so that the positions stay the same
+                entries.append(folded if len(folded) == len(entry) else entry)
+                starts.append(pos)
+                pos += len(entry) + 1
+            text = '\0'.join(entries)
+            rc = self.blocks[b] = (text, starts, ngrams(text))
+        return rc
+    
+    
+    def find(self, query, y, offset, backward = False):
+        '''
+        Find the next occurrence of a text, ignoring case
+        
+        @param   query:str      The text, may not contain NUL
+        @param   y:int          The index of the field to start in
+        @param   offset:int     The position in the field to start at
+        @param   backward:bool  Whether to find the last occurrence that starts before the position,
+                                rather than the first occurrence that starts at it or after it
+        @return  :(int, int)?   The index of the field with the occurrence and the position
+                                of the occurrence in it, `None` if there is none
+        '''
+        query = query.lower()
+        needles = ngrams(query)
+        b, first = y // self.block_size, True
+        while 0 <= b < len(self.blocks):
+            (text, starts, grams) = self.block(b)
+            if needles <= grams:
+                if first:
+                    pos = starts[y - b * self.block_size] + offset
+                else:
+                    pos = len(text) + 1 if backward else 0
+                if backward:
+                    pos = text.rfind(query, 0, pos - 1 + len(query))
+                else:
+                    pos = text.find(query, pos)
+                if pos >= 0:
+                    i = bisect_right(starts, pos) - 1
+                    return (b * self.block_size + i, pos - starts[i])
+            b += -1 if backward else 1
+            first = False
+        return None
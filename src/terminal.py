@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+pytagomacs – An Emacs like key–value editor library for Python
+
+Copyright © 2013, 2014  Mattias Andrée (maandree@member.fsf.org)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os
+import sys
+try:
+    import termios
+except ImportError:
+    termios = None
+
+
+
+def stty(*arguments):
+    '''
+    Run `stty`, which is used when `termios` is not available
+    
+    @param   arguments:*str  The arguments for `stty`
+    @return  :str            The output of `stty`, without the final line break
+    '''
+    from subprocess import Popen, PIPE
+    return Popen(['stty'] + list(arguments), stdout = PIPE).communicate()[0].decode('utf-8', 'error')[:-1]
+
+
+def get_size():
+    '''
+    Get the size of the terminal
+    
+    @return  (rows, columns):(int, int)  The height and width of the terminal
+    '''
+    try:
+        size = os.get_terminal_size(sys.stdout.fileno())
+        return (size.lines, size.columns)
+    except (OSError, ValueError):
+        pass
+    screen_size = stty('size').split(' ')
+    return (int(screen_size[0]), int(screen_size[1]))
+
+
+def save_mode(fd):
+    '''
+    Get the current TTY settings
+    
+    @param   fd:int          The file descriptor of the TTY
+    @return  :list<¿?>|str  The settings, an opaque value to pass to `restore_mode`
+    '''
+    if termios is not None:
+        try:
+            return termios.tcgetattr(fd)
+        except termios.error:
+            pass
+    return stty('--save')
+
+
+def set_mode(fd):
+    '''
+    Put the TTY in the mode the editor needs: no line buffering, no echo,
+    no signals from keystrokes and no flow control
+    
+    @param  fd:int  The file descriptor of the TTY
+    '''
+    if termios is not None:
+        try:
+            mode = termios.tcgetattr(fd)
+            mode[0] &= ~(termios.IXON | termios.IXOFF)
+            mode[3] &= ~(termios.ICANON | termios.ECHO | termios.ISIG)
+            mode[6][termios.VMIN], mode[6][termios.VTIME] = 1, 0
+            termios.tcsetattr(fd, termios.TCSANOW, mode)
+            return
+        except termios.error:
+            pass
+    stty(*'-icanon -echo -isig -ixon -ixoff'.split(' '))
+
+
+def restore_mode(fd, mode):
+    '''
+    Restore TTY settings
+    
+    @param  fd:int             The file descriptor of the TTY
+    @param  mode:list<¿?>|str  The settings, as returned by `save_mode`
+    '''
+    if isinstance(mode, str):
+        stty(mode)
+    else:
+        termios.tcsetattr(fd, termios.TCSADRAIN, mode)
+
+
+if __name__ == '__main__': # Compare the cost of opening and closing a session
+    import time
+    fd, n = sys.stdin.fileno(), 50
+    def stty_session():
+        stty('size')
+        mode = stty('--save')
+        stty(*'-icanon -echo -isig -ixon -ixoff'.split(' '))
+        stty(mode)
+    def termios_session():
+        get_size()
+        mode = save_mode(fd)
+        set_mode(fd)
+        restore_mode(fd, mode)
+    for name, session in (('stty', stty_session), ('termios', termios_session)):
+        start = time.monotonic()
+        for _ in range(n):
+            session()
+        print('%-8s %8.3f ms per session' % (name, (time.monotonic() - start) * 1000 / n))